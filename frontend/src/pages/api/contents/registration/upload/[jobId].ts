@@ -0,0 +1,68 @@
+// pages/api/contents/registration/upload/[jobId].ts
+import { NextApiRequest, NextApiResponse } from 'next';
+
+/**
+ * @swagger
+ * /api/contents/registration/upload/{jobId}:
+ *   get:
+ *     summary: Get the status of a PDF registration job
+ *     description: PDF registrations run in the background; poll this until status is "done" or "failed"
+ *     tags: [Registration]
+ *     parameters:
+ *       - in: path
+ *         name: jobId
+ *         required: true
+ *         schema:
+ *           type: string
+ *         description: Job id returned by /api/contents/registration/upload
+ *     responses:
+ *       200:
+ *         description: Current job state
+ *         content:
+ *           application/json:
+ *             schema:
+ *               type: object
+ *               properties:
+ *                 job_id:
+ *                   type: string
+ *                 status:
+ *                   type: string
+ *                   enum: [queued, running, done, failed]
+ *                 result:
+ *                   type: object
+ *                   properties:
+ *                     status:
+ *                       type: string
+ *                       example: "success"
+ *                     message:
+ *                       type: string
+ *                 faces:
+ *                   type: array
+ *                   items:
+ *                     type: object
+ *                 error:
+ *                   type: string
+ *       404:
+ *         description: Job not found
+ *       502:
+ *         description: Bad gateway - Error communicating with backend server
+ */
+
+export default async function handler(req: NextApiRequest, res: NextApiResponse) {
+  if (req.method === 'GET') {
+    const { jobId } = req.query;
+    try {
+      const backendResponse = await fetch(
+        process.env.NEXT_PUBLIC_BACKEND_API_URL + '/api/jobs/' + encodeURIComponent(String(jobId))
+      );
+      const backendData = await backendResponse.json();
+      res.status(backendResponse.status).json(backendData);
+    } catch (error) {
+      console.error('Error communicating with backend:', error);
+      res.status(502).json({ error: 'Error communicating with backend server', details: error.message });
+    }
+  } else {
+    res.setHeader('Allow', ['GET']);
+    res.status(405).end(`Method ${req.method} Not Allowed`);
+  }
+}
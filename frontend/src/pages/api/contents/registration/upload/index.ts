@@ -8,7 +8,7 @@ import fs from 'fs/promises';
  * /api/contents/registration/upload:
  *   post:
  *     summary: Register user from PDF document
- *     description: Accepts multipart form data with user details and a PDF file for registration
+ *     description: Accepts multipart form data with user details and a PDF file for registration. Registration runs in the background; the response carries a job_id to poll at /api/contents/registration/upload/{jobId}
  *     tags: [Registration]
  *     requestBody:
  *       required: true
@@ -5,6 +5,10 @@ import React from 'react';
 import Swal from 'sweetalert2';
 import { useSession } from 'next-auth/react';
 
+const JOB_POLL_INTERVAL_MS = 2000;
+// Stop waiting after this; the job keeps running and re-uploading the same PDF shows its status
+const JOB_TIMEOUT_MS = 5 * 60 * 1000;
+
 const Home: React.FC = () => {
     const { data: session, status } = useSession();
     const isAuthenticated = status === 'authenticated' && session && session.user;
@@ -41,6 +45,19 @@ const Home: React.FC = () => {
         }
     };
 
+    const waitForJob = async (jobId: string) => {
+        const deadline = Date.now() + JOB_TIMEOUT_MS;
+        while (Date.now() < deadline) {
+            await new Promise((resolve) => setTimeout(resolve, JOB_POLL_INTERVAL_MS));
+            const res = await fetch(`/api/contents/registration/upload/${jobId}`);
+            const job = await res.json();
+            if (!res.ok || job.status === 'done' || job.status === 'failed') {
+                return job;
+            }
+        }
+        return null;
+    };
+
     const submit = async (event: React.FormEvent) => {
         event.preventDefault();
         if (name && group && pdfFile) {
@@ -58,11 +75,33 @@ const Home: React.FC = () => {
                 const data = await res.json();
 
                 if (res.ok) {
-                    Swal.fire(
-                        'Success!',
-                        'Your data has been added successfully!',
-                        'success'
-                    );
+                    // Registration runs in the background, poll the job until it finishes
+                    Swal.fire({
+                        title: 'Processing...',
+                        text: 'Detecting the face in your PDF.',
+                        allowOutsideClick: false,
+                        didOpen: () => Swal.showLoading(),
+                    });
+                    const job = await waitForJob(data.job_id);
+                    if (job === null) {
+                        Swal.fire(
+                            'Still processing',
+                            'Registration is taking longer than expected. Upload the same PDF again later to see its result.',
+                            'warning'
+                        );
+                    } else if (job.status === 'done' && job.result?.status === 'success') {
+                        Swal.fire(
+                            'Success!',
+                            'Your data has been added successfully!',
+                            'success'
+                        );
+                    } else {
+                        Swal.fire(
+                            'Oops...',
+                            job.result?.message || job.error || 'An error occurred while registering.',
+                            'error'
+                        );
+                    }
                 } else {
                     Swal.fire(
                         'Oops...',
@@ -0,0 +1,32 @@
+import cv2
+import numpy as np
+
+# Canonical positions of YOLOv8-face's 5 keypoints (left eye, right eye, nose,
+# left mouth corner, right mouth corner) in a 112x112 face crop, the usual
+# ArcFace template.
+REFERENCE_POINTS_112 = np.array([
+    [38.2946, 51.6963],
+    [73.5318, 51.5014],
+    [56.0252, 71.7366],
+    [41.5493, 92.3655],
+    [70.7299, 92.2041],
+], dtype=np.float32)
+
+
+def landmark_points(landmarks):
+    """(5, 2) points from YOLO's flat [x1, y1, score1, ..., x5, y5, score5] row."""
+    landmarks = np.asarray(landmarks, dtype=np.float32).reshape(5, 3)
+    return np.ascontiguousarray(landmarks[:, :2])
+
+
+def align_face(image, landmarks, size=112):
+    """Warp a face to the canonical template with a similarity transform.
+
+    Returns a size x size crop, or None when the keypoints are degenerate.
+    """
+    src = landmark_points(landmarks)
+    dst = REFERENCE_POINTS_112 * (size / 112.0)
+    matrix, _ = cv2.estimateAffinePartial2D(src, dst, method=cv2.LMEDS)
+    if matrix is None:
+        return None
+    return cv2.warpAffine(image, matrix, (size, size), flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_CONSTANT, borderValue=0)
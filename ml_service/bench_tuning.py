@@ -0,0 +1,80 @@
+import argparse
+import time
+
+import numpy as np
+import torch
+
+import runtime_tuning
+from model import FaceNetModel
+from pipeline import load_model
+
+VARIANTS = [
+    ("eager_fp32", dict()),
+    ("channels_last", dict(channels_last=True)),
+    ("autocast_bf16", dict(autocast="bf16")),
+    ("channels_last+bf16", dict(channels_last=True, autocast="bf16")),
+    ("compile", dict(compile=True)),
+    ("compile+channels_last", dict(channels_last=True, compile=True)),
+]
+
+
+def time_model(model, batch, warmup, iterations):
+    with torch.no_grad():
+        for _ in range(warmup):
+            model(batch)
+        timings = []
+        for _ in range(iterations):
+            start = time.perf_counter()
+            output = model(batch)
+            timings.append((time.perf_counter() - start) * 1000)
+    return np.array(timings), output
+
+
+def run(args):
+    runtime_tuning.apply_thread_budget()
+    torch.manual_seed(0)
+    batch = torch.randn(args.batch_size, 3, 224, 224)
+
+    baseline_output = None
+    print(f"{'variant':<24} {'mean_ms':>9} {'p50_ms':>9} {'p95_ms':>9} {'speedup':>8} {'max_abs_diff':>13} {'min_cos':>8}")
+    baseline_mean = None
+    for name, options in VARIANTS:
+        if args.only and name not in args.only:
+            continue
+        if args.random_weights:
+            # Same seed for every variant so the outputs are comparable
+            torch.manual_seed(0)
+            base = FaceNetModel().eval()
+        else:
+            base = load_model(model_path=args.model_path)
+        try:
+            model = runtime_tuning.optimize_model(
+                base,
+                channels_last=options.get("channels_last", False),
+                autocast=options.get("autocast", ""),
+                compile=options.get("compile", False),
+            )
+            timings, output = time_model(model, batch, args.warmup, args.iterations)
+        except Exception as e:
+            print(f"{name:<24} failed: {e}")
+            continue
+
+        if baseline_output is None:
+            baseline_output = output
+            baseline_mean = timings.mean()
+        diff = (output - baseline_output).abs().max().item()
+        cosine = torch.nn.functional.cosine_similarity(output, baseline_output).min().item()
+        print(f"{name:<24} {timings.mean():>9.2f} {np.percentile(timings, 50):>9.2f} {np.percentile(timings, 95):>9.2f} "
+              f"{baseline_mean / timings.mean():>7.2f}x {diff:>13.5f} {cosine:>8.5f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark FaceNetModel CPU tuning options against eager fp32")
+    parser.add_argument('--model-path', type=str, default='./models/models_0821_50.pth')
+    parser.add_argument('--random-weights', action='store_true', help="skip loading the checkpoint")
+    parser.add_argument('--batch-size', type=int, default=1)
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--only', nargs='*', help="variants to run (the first one is the baseline)")
+    args = parser.parse_args()
+    run(args)
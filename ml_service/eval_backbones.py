@@ -0,0 +1,102 @@
+import argparse
+import os
+import time
+
+import numpy as np
+
+import ingest
+import pipeline
+from model import BACKBONES, build_backbone
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+
+def load_faces(root):
+    """Detect the first face of every image under root/<identity>/."""
+    faces = []
+    for identity in sorted(os.listdir(root)):
+        identity_dir = os.path.join(root, identity)
+        if not os.path.isdir(identity_dir):
+            continue
+        for filename in sorted(os.listdir(identity_dir)):
+            if not filename.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            frame = ingest.load_frame(os.path.join(identity_dir, filename))
+            bboxes, _, _, landmarks = pipeline.detect_faces(frame.rgb, rgb=True, source_size=frame.source_size)
+            if len(bboxes) == 0:
+                print(f"No face in {identity}/{filename}, skipped")
+                continue
+            faces.append((identity, frame.rgb, bboxes[0], landmarks[0]))
+    return faces
+
+
+def evaluate(embeddings, identities, threshold):
+    identities = np.asarray(identities)
+    distances = np.linalg.norm(embeddings[:, None, :] - embeddings[None, :, :], axis=-1)
+    np.fill_diagonal(distances, np.inf)
+
+    # Leave-one-out nearest neighbour, only for identities with a second image
+    same = identities[:, None] == identities[None, :]
+    np.fill_diagonal(same, False)
+    probes = same.any(axis=1)
+    nearest = np.argmin(distances, axis=1)
+    top1 = (identities[nearest] == identities)[probes].mean() if probes.any() else float('nan')
+
+    # Verification at the service threshold over all pairs
+    upper = np.triu_indices(len(identities), k=1)
+    pair_same = same[upper]
+    pair_match = distances[upper] <= threshold
+    tar = pair_match[pair_same].mean() if pair_same.any() else float('nan')
+    far = pair_match[~pair_same].mean() if (~pair_same).any() else float('nan')
+    return top1, tar, far
+
+
+def run(args):
+    faces = load_faces(args.root)
+    identities = [face[0] for face in faces]
+    print(f"{len(faces)} faces, {len(set(identities))} identities\n")
+    print(f"{'version':<30} {'params_m':>9} {'top1':>7} {'tar':>7} {'far':>7} {'ms/face':>8} {'ms/batch':>9}")
+
+    for backbone in args.backbones:
+        try:
+            model = pipeline.load_model(backbone=backbone)
+        except RuntimeError as e:
+            if not args.random_weights:
+                print(f"{backbone:<30} skipped: {e}")
+                continue
+            model = build_backbone(backbone).to(pipeline.device).eval()
+        params = sum(p.numel() for p in model.parameters()) / 1e6
+
+        for align in args.align:
+            embedder = pipeline.Embedder(model, backbone=backbone, align=align)
+            inputs = [embedder.face_input(rgb, bbox, landmarks) for _, rgb, bbox, landmarks in faces]
+
+            embedder.embed(inputs[:1])  # warm up
+            start = time.perf_counter()
+            for face in inputs[:args.latency_samples]:
+                embedder.embed([face])
+            single_ms = (time.perf_counter() - start) * 1000 / min(len(inputs), args.latency_samples)
+
+            start = time.perf_counter()
+            embeddings = np.concatenate([
+                embedder.embed(inputs[i:i + args.batch_size]) for i in range(0, len(inputs), args.batch_size)
+            ])
+            batch_ms = (time.perf_counter() - start) * 1000 / max(1, -(-len(inputs) // args.batch_size))
+
+            top1, tar, far = evaluate(embeddings, identities, args.threshold)
+            print(f"{embedder.version:<30} {params:>9.1f} {top1:>7.3f} {tar:>7.3f} {far:>7.3f} {single_ms:>8.1f} {batch_ms:>9.1f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare embedding backbones on a labelled folder of faces (root/<identity>/*.jpg)")
+    parser.add_argument('root', type=str, help="folder with one sub-folder of images per person")
+    parser.add_argument('--backbones', nargs='*', default=sorted(BACKBONES), choices=sorted(BACKBONES))
+    parser.add_argument('--align', nargs='*', type=lambda v: v == 'on', default=[False, True],
+                        help="'on' and/or 'off' (default both)")
+    parser.add_argument('--threshold', type=float, default=1.3, help="distance threshold used by recognize")
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--latency-samples', type=int, default=20)
+    parser.add_argument('--random-weights', action='store_true',
+                        help="time backbones without a checkpoint (accuracy is meaningless)")
+    args = parser.parse_args()
+    run(args)
@@ -0,0 +1,131 @@
+import base64
+import csv
+import io
+import json
+from datetime import date, datetime, timedelta
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from dateutil import parser
+
+EXPORT_BATCH_SIZE = 1000
+EXPORT_MAX_BATCH_SIZE = 10000
+PAGE_SIZE = 100
+PAGE_MAX_SIZE = 1000
+EXPORT_FIELDS = ["id", "name", "group", "timestamp", "attended"]
+PROJECTION = {"name": 1, "group": 1, "timestamp": 1, "attended": 1}
+# Exports and pages are read in (timestamp, _id) order, which is also the keyset
+SORT = [("timestamp", 1), ("_id", 1)]
+
+
+def ensure_indexes(attendance_collection):
+    # One per filter combination, each ending in the sort keys so Mongo never sorts in memory
+    attendance_collection.create_index([("timestamp", 1), ("_id", 1)])
+    attendance_collection.create_index([("group", 1), ("timestamp", 1), ("_id", 1)])
+    attendance_collection.create_index([("name", 1), ("timestamp", 1), ("_id", 1)])
+    attendance_collection.create_index([("name", 1), ("group", 1), ("timestamp", 1), ("_id", 1)])
+
+
+def parse_range(start=None, end=None):
+    """(start, end, end_exclusive) from ISO strings, ValueError if malformed.
+
+    A date-only `end` covers that whole day, like the rollup reports: it
+    becomes the next midnight, exclusive. Any other `end` is inclusive.
+    """
+    start = parser.isoparse(start) if start else None
+    if not end:
+        return start, None, False
+    try:
+        day = date.fromisoformat(end)
+    except ValueError:
+        return start, parser.isoparse(end), False
+    return start, datetime(day.year, day.month, day.day) + timedelta(days=1), True
+
+
+def build_query(group=None, name=None, start=None, end=None, end_exclusive=False):
+    query = {}
+    if group:
+        query["group"] = group.lower()
+    if name:
+        query["name"] = name.lower()
+    if start or end:
+        query["timestamp"] = {}
+        if start:
+            query["timestamp"]["$gte"] = start
+        if end:
+            query["timestamp"]["$lt" if end_exclusive else "$lte"] = end
+    return query
+
+
+def to_row(doc):
+    return {
+        "id": str(doc["_id"]),
+        "name": doc.get("name"),
+        "group": doc.get("group"),
+        "timestamp": doc["timestamp"].isoformat() if doc.get("timestamp") else None,
+        "attended": doc.get("attended"),
+    }
+
+
+def stream_rows(collection, query, batch_size=EXPORT_BATCH_SIZE):
+    """Yield export rows batch by batch from a server-side cursor."""
+    cursor = collection.find(query, PROJECTION).sort(SORT).batch_size(batch_size)
+    try:
+        batch = []
+        for doc in cursor:
+            batch.append(to_row(doc))
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+    finally:
+        cursor.close()
+
+
+def stream_csv(collection, query, batch_size=EXPORT_BATCH_SIZE):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS)
+    writer.writeheader()
+    yield buffer.getvalue()
+    for batch in stream_rows(collection, query, batch_size):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(batch)
+        yield buffer.getvalue()
+
+
+def stream_ndjson(collection, query, batch_size=EXPORT_BATCH_SIZE):
+    for batch in stream_rows(collection, query, batch_size):
+        yield "".join(json.dumps(row) + "\n" for row in batch)
+
+
+def encode_page_token(doc):
+    key = f"{doc['timestamp'].isoformat()}|{doc['_id']}"
+    return base64.urlsafe_b64encode(key.encode()).decode()
+
+
+def decode_page_token(token):
+    """(timestamp, _id) of the last record of the previous page, ValueError if malformed."""
+    try:
+        timestamp, _, object_id = base64.urlsafe_b64decode(token.encode()).decode().partition("|")
+        return parser.isoparse(timestamp), ObjectId(object_id)
+    except (ValueError, InvalidId, UnicodeDecodeError) as e:
+        raise ValueError(f"Invalid page token: {token}") from e
+
+
+def page(collection, query, after=None, limit=PAGE_SIZE):
+    """One page in (timestamp, _id) order starting after the given token.
+
+    Keyset pagination: each page is an index range scan from the previous
+    page's last key, so page 1000 costs the same as page 1.
+    """
+    if after:
+        timestamp, object_id = decode_page_token(after)
+        query = {"$and": [query, {"$or": [
+            {"timestamp": {"$gt": timestamp}},
+            {"timestamp": timestamp, "_id": {"$gt": object_id}},
+        ]}]}
+    docs = list(collection.find(query, PROJECTION).sort(SORT).limit(limit + 1))
+    next_token = encode_page_token(docs[limit - 1]) if len(docs) > limit else None
+    return [to_row(doc) for doc in docs[:limit]], next_token
@@ -0,0 +1,191 @@
+import logging
+import threading
+import time
+
+import numpy as np
+from pymongo import ReturnDocument
+
+# How often a worker asks Mongo whether another worker changed the gallery
+GALLERY_REFRESH_SECONDS = 2.0
+
+GALLERY_META_ID = "gallery"
+
+# Embeddings computed before versioning live in `features`, every other
+# version under `embeddings.<version>` so a re-embedding job can write the
+# next version side by side
+LEGACY_EMBEDDING_VERSION = "facenet_resnet50-crop"
+
+
+def embedding_field(embedding_version):
+    if embedding_version == LEGACY_EMBEDDING_VERSION:
+        return "features"
+    return f"embeddings.{embedding_version}"
+
+
+def embedding_fields(embedding_version, features):
+    """Fields to $set (or insert) to store one student's embedding."""
+    if embedding_version == LEGACY_EMBEDDING_VERSION:
+        return {"features": features}
+    return {"embeddings": {embedding_version: features}}
+
+
+def activate_embedding_version(meta_collection, embedding_version):
+    """Switch every worker to another embedding version in one update."""
+    meta_collection.update_one(
+        {"_id": GALLERY_META_ID},
+        {"$set": {"embedding_version": embedding_version}, "$inc": {"version": 1}},
+        upsert=True,
+    )
+
+
+class Gallery:
+    """In-memory copy of the registered students' embeddings.
+
+    Loaded once (in the parent process when running several workers, so the
+    matrix is shared copy-on-write) and kept in sync through a version counter
+    in the `meta` collection that `register` bumps on every insert.
+
+    The same meta document names the active embedding version; students are
+    loaded from that version's field.
+    """
+
+    def __init__(self, default_embedding_version=LEGACY_EMBEDDING_VERSION, refresh_seconds=GALLERY_REFRESH_SECONDS):
+        self.default_embedding_version = default_embedding_version
+        self.refresh_seconds = refresh_seconds
+        self.names = []
+        self.groups = []
+        self.features = np.zeros((0, 0), dtype=np.float32)
+        self.sq_norms = np.zeros(0, dtype=np.float32)
+        self.version = None
+        self.embedding_version = default_embedding_version
+        self.checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.names)
+
+    def current_version(self, meta_collection):
+        doc = meta_collection.find_one({"_id": GALLERY_META_ID}) or {}
+        return doc.get("version", 0), doc.get("embedding_version", self.default_embedding_version)
+
+    def load(self, students_collection, meta_collection):
+        version, embedding_version = self.current_version(meta_collection)
+        field = embedding_field(embedding_version)
+        names, groups, rows = [], [], []
+        for doc in students_collection.find({field: {"$exists": True}}, {"name": 1, "group": 1, field: 1}):
+            value = doc
+            for key in field.split("."):
+                value = value[key]
+            names.append(doc["name"])
+            groups.append(doc["group"])
+            rows.append(np.asarray(value, dtype=np.float32).ravel())
+        features = np.vstack(rows) if rows else np.zeros((0, 0), dtype=np.float32)
+        sq_norms = np.einsum("ij,ij->i", features, features)
+        missing = students_collection.count_documents({field: {"$exists": False}})
+
+        with self._lock:
+            self.names, self.groups, self.features, self.sq_norms = names, groups, features, sq_norms
+            self.version = version
+            self.embedding_version = embedding_version
+            self.checked_at = time.monotonic()
+        logging.info(f"Loaded gallery version {version} ({embedding_version}) with {len(names)} students")
+        if missing:
+            logging.warning(f"{missing} students have no {embedding_version} embedding and cannot be recognized")
+
+    def refresh_if_stale(self, students_collection, meta_collection):
+        if time.monotonic() - self.checked_at < self.refresh_seconds:
+            return
+        self.checked_at = time.monotonic()
+        if self.current_version(meta_collection)[0] != self.version:
+            self.load(students_collection, meta_collection)
+
+    def add(self, name, group, features, meta_collection):
+        """Append a newly registered student and tell the other workers.
+
+        `features` must be in the gallery's embedding version.
+        """
+        row = np.asarray(features, dtype=np.float32).ravel()
+        doc = meta_collection.find_one_and_update(
+            {"_id": GALLERY_META_ID},
+            {"$inc": {"version": 1}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        with self._lock:
+            if self.version is not None and doc["version"] == self.version + 1:
+                if len(self.names) == 0:
+                    self.features = row[np.newaxis, :]
+                else:
+                    self.features = np.vstack([self.features, row])
+                self.sq_norms = np.append(self.sq_norms, np.float32(row @ row))
+                self.names = self.names + [name]
+                self.groups = self.groups + [group]
+                self.version = doc["version"]
+            else:
+                # Another worker registered someone in between, reload on next check
+                self.checked_at = 0.0
+
+    def snapshot(self):
+        with self._lock:
+            return self.names, self.groups, self.features, self.sq_norms
+
+    @staticmethod
+    def _distances(matrix, sq_norms, features):
+        # |a - q|^2 = |a|^2 - 2 a.q + |q|^2: one matrix-vector product instead
+        # of materialising the (n, 128) difference matrix
+        query = np.asarray(features, dtype=np.float32).ravel()
+        sq_distances = sq_norms - 2 * (matrix @ query) + query @ query
+        return np.sqrt(np.maximum(sq_distances, 0))
+
+    def nearest(self, features):
+        """Return (name, group, distance) of the closest student, or None."""
+        names, groups, matrix, sq_norms = self.snapshot()
+        if len(names) == 0:
+            return None
+        distances = self._distances(matrix, sq_norms, features)
+        index = int(np.argmin(distances))
+        return names[index], groups[index], float(distances[index])
+
+    def top_k(self, features, k):
+        """The k closest students, nearest first, as (name, group, distance)."""
+        names, groups, matrix, sq_norms = self.snapshot()
+        if len(names) == 0:
+            return []
+        distances = self._distances(matrix, sq_norms, features)
+        k = min(k, len(names))
+        # O(n) selection of the k smallest, only those k get sorted
+        indices = np.argpartition(distances, k - 1)[:k]
+        indices = indices[np.argsort(distances[indices])]
+        return [(names[i], groups[i], float(distances[i])) for i in indices]
+
+    def within(self, features, max_distance, limit=5):
+        """Students closer than max_distance, nearest first, as (name, group, distance)."""
+        names, groups, matrix, sq_norms = self.snapshot()
+        if len(names) == 0:
+            return []
+        distances = self._distances(matrix, sq_norms, features)
+        indices = np.flatnonzero(distances <= max_distance)
+        indices = indices[np.argsort(distances[indices])][:limit]
+        return [(names[i], groups[i], float(distances[i])) for i in indices]
+
+
+class GroupThresholds:
+    """Per-group recognition thresholds (`match_threshold` in the groups collection).
+
+    Cached and re-read every `refresh_seconds`, like the gallery.
+    """
+
+    def __init__(self, default, refresh_seconds=GALLERY_REFRESH_SECONDS):
+        self.default = default
+        self.refresh_seconds = refresh_seconds
+        self.thresholds = {}
+        self.checked_at = 0.0
+
+    def get(self, groups_collection, group):
+        if time.monotonic() - self.checked_at >= self.refresh_seconds:
+            self.thresholds = {
+                doc["name"]: float(doc["match_threshold"])
+                for doc in groups_collection.find({"match_threshold": {"$exists": True}}, {"name": 1, "match_threshold": 1})
+            }
+            self.checked_at = time.monotonic()
+        return self.thresholds.get(group, self.default)
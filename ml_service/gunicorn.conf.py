@@ -0,0 +1,26 @@
+# Multi-worker serving: the app (models, dlib predictor, YOLO net and the
+# student gallery) is imported once in the master and shared copy-on-write
+# by the forked uvicorn workers.
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8080')}"
+workers = int(os.environ.get("WEB_CONCURRENCY", "2"))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+timeout = int(os.environ.get("WORKER_TIMEOUT", "120"))
+
+# Lets the workers know they have siblings, see memstats.worker_memory
+os.environ["ML_SERVICE_WORKERS"] = str(workers)
+
+
+def when_ready(server):
+    # Close the master's MongoClient (and its monitor threads) before forking
+    import main
+    main.client.close()
+
+
+def post_fork(server, worker):
+    import main
+    import runtime_tuning
+    main.connect_mongo()
+    runtime_tuning.apply_thread_budget()
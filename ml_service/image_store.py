@@ -0,0 +1,216 @@
+import argparse
+import fcntl
+import hashlib
+import io
+import logging
+import os
+import threading
+import time
+import zipfile
+from datetime import date, timedelta
+
+from PIL import Image
+
+import ingest
+
+ATTEND_DIR = os.path.join('images', 'attend')
+# Check-in photos are kept at this size; they are evidence, not model input
+ATTEND_IMAGE_MAX_SIDE = int(os.environ.get("ATTEND_IMAGE_MAX_SIDE", "640"))
+ATTEND_JPEG_QUALITY = int(os.environ.get("ATTEND_JPEG_QUALITY", "80"))
+# Days older than this are packed into one archive per day and their loose files removed
+ATTEND_PACK_AFTER_DAYS = int(os.environ.get("ATTEND_PACK_AFTER_DAYS", "2"))
+# Days older than this are deleted altogether, 0 keeps them forever
+ATTEND_RETENTION_DAYS = int(os.environ.get("ATTEND_RETENTION_DAYS", "0"))
+ATTEND_COMPACT_INTERVAL_SECONDS = int(os.environ.get("ATTEND_COMPACT_INTERVAL_SECONDS", "3600"))
+
+ARCHIVE_EXTENSION = ".zip"
+
+
+class AttendanceImageStore:
+    """Check-in photos under images/attend/<year>/<month>/<day>/.
+
+    New photos are downscaled, re-encoded and named by the hash of the
+    upload, so the same frame sent twice is stored once. `compact` packs
+    each finished day into <day>.zip (stored, not compressed: JPEGs do not
+    shrink) whose central directory is the index for reading single photos
+    back, then removes the loose files; past the retention age whole days
+    are deleted.
+    """
+
+    def __init__(self, root=ATTEND_DIR, max_side=ATTEND_IMAGE_MAX_SIDE, quality=ATTEND_JPEG_QUALITY):
+        self.root = root
+        self.max_side = max_side
+        self.quality = quality
+
+    def day_path(self, day):
+        return os.path.join(self.root, str(day.year), str(day.month), str(day.day))
+
+    def encode(self, image_data):
+        """Downscaled JPEG of an upload, or the upload itself if it is already small."""
+        try:
+            image = Image.open(io.BytesIO(image_data))
+            if max(image.size) <= self.max_side and image.format == "JPEG":
+                return image_data
+            frame = ingest.decode_image(image, self.max_side)
+            byte_arr = io.BytesIO()
+            frame.image.save(byte_arr, format="JPEG", quality=self.quality, optimize=True)
+            return byte_arr.getvalue()
+        except Exception as e:
+            logging.warning(f"Could not re-encode attendance image, keeping the original: {e}")
+            return image_data
+
+    def put(self, image_data, timestamp):
+        """Store one check-in photo, returns its key (<year>/<month>/<day>/<hash>.jpg)."""
+        digest = hashlib.sha256(image_data).hexdigest()[:32]
+        day_dir = self.day_path(timestamp)
+        key = "/".join([str(timestamp.year), str(timestamp.month), str(timestamp.day), f"{digest}.jpg"])
+        path = os.path.join(day_dir, f"{digest}.jpg")
+        if os.path.exists(path) or self._archived(day_dir, f"{digest}.jpg"):
+            return key
+
+        os.makedirs(day_dir, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(self.encode(image_data))
+        os.replace(tmp_path, path)
+        return key
+
+    def _archived(self, day_dir, filename):
+        archive_path = day_dir + ARCHIVE_EXTENSION
+        if not os.path.exists(archive_path):
+            return False
+        with zipfile.ZipFile(archive_path) as archive:
+            return filename in archive.NameToInfo
+
+    def get(self, key):
+        """Bytes of a stored photo, from its loose file or its day's archive, or None."""
+        parts = key.split("/")
+        if len(parts) != 4 or any(part in ("", ".", "..") or os.sep in part for part in parts):
+            return None
+        year, month, day, filename = parts
+        day_dir = os.path.join(self.root, year, month, day)
+        path = os.path.join(day_dir, filename)
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                return f.read()
+        archive_path = day_dir + ARCHIVE_EXTENSION
+        if os.path.exists(archive_path):
+            with zipfile.ZipFile(archive_path) as archive:
+                if filename in archive.NameToInfo:
+                    return archive.read(filename)
+        return None
+
+    def days(self):
+        """(day, loose directory or None, archive or None) for every stored day."""
+        found = {}
+        for year in _numeric_entries(self.root):
+            for month in _numeric_entries(os.path.join(self.root, year)):
+                month_dir = os.path.join(self.root, year, month)
+                for entry in os.listdir(month_dir):
+                    name, extension = os.path.splitext(entry)
+                    if not name.isdigit() or extension not in ("", ARCHIVE_EXTENSION):
+                        continue
+                    try:
+                        day = date(int(year), int(month), int(name))
+                    except ValueError:
+                        continue
+                    loose, archive = found.get(day, (None, None))
+                    if extension == ARCHIVE_EXTENSION:
+                        archive = os.path.join(month_dir, entry)
+                    else:
+                        loose = os.path.join(month_dir, entry)
+                    found[day] = (loose, archive)
+        return sorted((day, loose, archive) for day, (loose, archive) in found.items())
+
+    def pack_day(self, day_dir):
+        """Move a day's loose photos into its archive, returns how many were packed."""
+        archive_path = day_dir + ARCHIVE_EXTENSION
+        filenames = sorted(f for f in os.listdir(day_dir) if not f.endswith(".tmp"))
+        if not filenames:
+            os.rmdir(day_dir)
+            return 0
+
+        # Rewrite the archive with the old and new entries, then swap it in, so
+        # a crash never leaves a half-written archive behind
+        tmp_path = f"{archive_path}.{os.getpid()}.tmp"
+        with zipfile.ZipFile(tmp_path, "w", zipfile.ZIP_STORED) as archive:
+            if os.path.exists(archive_path):
+                with zipfile.ZipFile(archive_path) as old:
+                    for info in old.infolist():
+                        if info.filename not in filenames:
+                            archive.writestr(info, old.read(info))
+            for filename in filenames:
+                with open(os.path.join(day_dir, filename), "rb") as f:
+                    # Photos saved before this store existed are still full size
+                    archive.writestr(filename, self.encode(f.read()))
+        os.replace(tmp_path, archive_path)
+
+        for filename in filenames:
+            os.remove(os.path.join(day_dir, filename))
+        try:
+            os.rmdir(day_dir)
+        except OSError:
+            pass  # a late check-in landed while packing, it goes in next time
+        return len(filenames)
+
+    def compact(self, pack_after_days=ATTEND_PACK_AFTER_DAYS, retention_days=ATTEND_RETENTION_DAYS, today=None):
+        """Pack finished days and delete expired ones. Only one process runs it at a time."""
+        os.makedirs(self.root, exist_ok=True)
+        with open(os.path.join(self.root, ".compact.lock"), "w") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                logging.info("Attendance image compaction already running in another process")
+                return {"packed_days": 0, "packed_images": 0, "deleted_days": 0}
+
+            today = today or date.today()
+            pack_before = today - timedelta(days=pack_after_days)
+            delete_before = today - timedelta(days=retention_days) if retention_days > 0 else None
+            stats = {"packed_days": 0, "packed_images": 0, "deleted_days": 0}
+            for day, loose, archive in self.days():
+                if delete_before is not None and day < delete_before:
+                    for path in (loose, archive):
+                        if path is not None and os.path.isdir(path):
+                            for filename in os.listdir(path):
+                                os.remove(os.path.join(path, filename))
+                            os.rmdir(path)
+                        elif path is not None:
+                            os.remove(path)
+                    stats["deleted_days"] += 1
+                elif loose is not None and day < pack_before:
+                    stats["packed_images"] += self.pack_day(loose)
+                    stats["packed_days"] += 1
+            logging.info(f"Attendance image compaction: {stats}")
+            return stats
+
+    def start_compaction(self, interval=ATTEND_COMPACT_INTERVAL_SECONDS):
+        """Run `compact` every `interval` seconds on a daemon thread."""
+        def loop():
+            while True:
+                try:
+                    self.compact()
+                except Exception as e:
+                    logging.error(f"Attendance image compaction failed: {e}", exc_info=True)
+                time.sleep(interval)
+
+        thread = threading.Thread(target=loop, name="attend-compaction", daemon=True)
+        thread.start()
+        return thread
+
+
+def _numeric_entries(path):
+    if not os.path.isdir(path):
+        return []
+    return [entry for entry in os.listdir(path) if entry.isdigit() and os.path.isdir(os.path.join(path, entry))]
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Pack and prune stored check-in photos")
+    parser.add_argument('--root', type=str, default=ATTEND_DIR)
+    parser.add_argument('--pack-after-days', type=int, default=ATTEND_PACK_AFTER_DAYS)
+    parser.add_argument('--retention-days', type=int, default=ATTEND_RETENTION_DAYS, help="0 keeps every day")
+    args = parser.parse_args()
+
+    store = AttendanceImageStore(args.root)
+    print(store.compact(args.pack_after_days, args.retention_days))
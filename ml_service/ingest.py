@@ -0,0 +1,56 @@
+import io
+import os
+
+import numpy as np
+from PIL import Image, ImageOps
+
+# Uploads are decoded to at most this many pixels on the long side. YOLO runs
+# at 640 and the embedder at 224, so 12 MP phone photos never need full size.
+INGEST_MAX_SIDE = int(os.environ.get("INGEST_MAX_SIDE", "1280"))
+
+
+class Frame:
+    """A decoded upload shared by detection, liveness and face cropping.
+
+    `rgb` is the one pixel buffer of the request (HxWx3 uint8, already
+    EXIF-oriented); crops are views into it rather than copies.
+    """
+
+    def __init__(self, image, source_size):
+        self.image = image
+        self.rgb = np.asarray(image)
+        self.source_size = source_size
+
+    @property
+    def shape(self):
+        return self.rgb.shape
+
+    def crop(self, bbox):
+        """View of the face at an [x1, y1, w, h] box, clipped to the frame."""
+        x1, y1, w, h = np.asarray(bbox).astype(int)
+        height, width = self.rgb.shape[:2]
+        x2, y2 = min(width, x1 + w), min(height, y1 + h)
+        x1, y1 = max(0, x1), max(0, y1)
+        return self.rgb[y1:y2, x1:x2]
+
+
+def decode_image(image, max_side=INGEST_MAX_SIDE):
+    source_size = image.size
+    if max_side:
+        # For JPEGs thumbnail() sets draft mode first, so libjpeg's DCT scaling
+        # decodes at 1/2, 1/4 or 1/8 size instead of decoding 12 MP and resizing
+        image.thumbnail((max_side, max_side), Image.BILINEAR)
+    image = ImageOps.exif_transpose(image)
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    return Frame(image, source_size)
+
+
+def decode_upload(data, max_side=INGEST_MAX_SIDE):
+    """Decode uploaded image bytes into a Frame near the working resolution."""
+    return decode_image(Image.open(io.BytesIO(data)), max_side)
+
+
+def load_frame(path, max_side=INGEST_MAX_SIDE):
+    # Pillow closes the file itself once a single-frame image is loaded
+    return decode_image(Image.open(path), max_side)
@@ -0,0 +1,157 @@
+import asyncio
+import hashlib
+import logging
+import os
+from datetime import datetime, timedelta
+
+import pymongo
+from pymongo import ReturnDocument
+
+JOB_DIR = os.environ.get("JOB_DIR", "./images/temp/jobs")
+# Concurrent jobs per process; their ML work still goes through the bulk queue
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "1"))
+# Running jobs not updated for this long belong to a dead worker and are retried
+JOB_STALE_SECONDS = int(os.environ.get("JOB_STALE_SECONDS", "600"))
+# Live workers touch their running job this often, well inside JOB_STALE_SECONDS
+JOB_HEARTBEAT_SECONDS = JOB_STALE_SECONDS / 4
+# Idle workers also check Mongo this often, for jobs queued by other processes
+JOB_POLL_SECONDS = 2.0
+
+os.makedirs(JOB_DIR, exist_ok=True)
+
+FINISHED = ("done", "failed")
+
+
+def job_id_for(kind, *parts):
+    """Job id derived from the upload itself, so a retried upload maps to the same job."""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part if isinstance(part, bytes) else str(part).encode())
+        digest.update(b"\0")
+    return f"{kind}-{digest.hexdigest()[:32]}"
+
+
+def job_file(job_id, extension):
+    return os.path.join(JOB_DIR, f"{job_id}{extension}")
+
+
+class JobQueue:
+    """Background jobs persisted in the `jobs` collection.
+
+    The collection is the queue: workers in every process claim the oldest
+    queued job with an atomic update, so jobs survive restarts and are never
+    run twice at the same time. `handler(queue, job)` is an async callable
+    that returns the job result; it may record progress with `update`.
+    """
+
+    def __init__(self, collection, kind, handler, workers=JOB_WORKERS):
+        self.collection = collection
+        self.kind = kind
+        self.handler = handler
+        self.workers = workers
+        self._wakeup = None
+        self._tasks = []
+
+    def create(self, job_id, payload, rerun=False):
+        """Queue a job unless it already exists, returns (job, created).
+
+        A job that failed is queued again, finished or pending ones are
+        returned as they are; with `rerun` a finished job is queued again too.
+        """
+        now = datetime.now()
+        try:
+            self.collection.insert_one({
+                "_id": job_id,
+                "kind": self.kind,
+                "status": "queued",
+                "payload": payload,
+                "attempts": 0,
+                "created_at": now,
+                "updated_at": now,
+            })
+            created = True
+        except pymongo.errors.DuplicateKeyError:
+            created = self.collection.update_one(
+                {"_id": job_id, "status": {"$in": list(FINISHED) if rerun else ["failed"]}},
+                {"$set": {"status": "queued", "updated_at": now}, "$unset": {"error": "", "result": "", "faces": ""}},
+            ).modified_count > 0
+        if created:
+            self.notify()
+        return self.get(job_id), created
+
+    def get(self, job_id):
+        return self.collection.find_one({"_id": job_id})
+
+    def update(self, job_id, fields):
+        fields = dict(fields, updated_at=datetime.now())
+        self.collection.update_one({"_id": job_id}, {"$set": fields})
+
+    def claim(self):
+        now = datetime.now()
+        return self.collection.find_one_and_update(
+            {"kind": self.kind, "status": "queued"},
+            {"$set": {"status": "running", "started_at": now, "updated_at": now, "worker": os.getpid()}, "$inc": {"attempts": 1}},
+            sort=[("created_at", 1)],
+            return_document=ReturnDocument.AFTER,
+        )
+
+    def requeue_stale(self):
+        result = self.collection.update_many(
+            {
+                "kind": self.kind,
+                "status": "running",
+                "updated_at": {"$lt": datetime.now() - timedelta(seconds=JOB_STALE_SECONDS)},
+            },
+            {"$set": {"status": "queued", "updated_at": datetime.now()}},
+        )
+        if result.modified_count:
+            logging.warning(f"Re-queued {result.modified_count} stale {self.kind} jobs")
+
+    async def _heartbeat(self, job_id):
+        # A job can wait on the bulk queue for longer than JOB_STALE_SECONDS,
+        # without this it would be requeued and run a second time meanwhile
+        while True:
+            await asyncio.sleep(JOB_HEARTBEAT_SECONDS)
+            try:
+                self.collection.update_one({"_id": job_id, "status": "running"}, {"$set": {"updated_at": datetime.now()}})
+            except Exception as e:
+                logging.warning(f"Could not refresh {self.kind} job {job_id}: {e}")
+
+    def notify(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def start(self):
+        """Start the workers on the running event loop (once per process)."""
+        self.collection.create_index([("kind", 1), ("status", 1), ("created_at", 1)])
+        self.requeue_stale()
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        logging.info(f"Started {self.workers} {self.kind} job workers")
+
+    async def _worker(self):
+        while True:
+            try:
+                job = self.claim()
+            except Exception as e:
+                logging.error(f"Could not claim a {self.kind} job: {e}")
+                job = None
+
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), JOB_POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    self.requeue_stale()
+                continue
+
+            logging.info(f"Running {self.kind} job {job['_id']} (attempt {job['attempts']})")
+            heartbeat = asyncio.create_task(self._heartbeat(job["_id"]))
+            try:
+                result = await self.handler(self, job)
+                self.update(job["_id"], {"status": "done", "result": result, "finished_at": datetime.now()})
+            except Exception as e:
+                logging.error(f"{self.kind} job {job['_id']} failed: {e}", exc_info=True)
+                self.update(job["_id"], {"status": "failed", "error": str(e), "finished_at": datetime.now()})
+            finally:
+                heartbeat.cancel()
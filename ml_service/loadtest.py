@@ -0,0 +1,337 @@
+import argparse
+import asyncio
+import collections
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+import uuid
+
+import fitz
+import httpx
+import numpy as np
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+LOADTEST_GROUP = "loadtest"
+JOB_POLL_SECONDS = 0.5
+# JSON statuses the API returns with a 200 that are still failures for the client
+FAILURE_STATUSES = ("error", "failed", "failure", "duplicate")
+# Same as /api/recognize: a student checked in within this long is refused
+CHECK_IN_COOLDOWN_SECONDS = 3600
+
+
+def load_faces(faces_dir):
+    faces = []
+    for root, _, filenames in os.walk(faces_dir):
+        for filename in sorted(filenames):
+            if filename.lower().endswith(IMAGE_EXTENSIONS):
+                with open(os.path.join(root, filename), "rb") as f:
+                    faces.append(f.read())
+    if not faces:
+        raise SystemExit(f"No face images under {faces_dir}")
+    return faces
+
+
+def make_pdf(image_bytes):
+    """One-page PDF with the face image on it, like the registration forms."""
+    doc = fitz.open()
+    page = doc.new_page()
+    page.insert_image(fitz.Rect(72, 72, 372, 472), stream=image_bytes)
+    return doc.tobytes()
+
+
+class Identities:
+    """Which faces are registered and which students can still check in.
+
+    Recognize refuses a student for an hour after their check-in and
+    registration refuses a face that is already registered, so replaying
+    the same faces would mostly measure those refusals. Check-ins go to
+    seeded students not checked in yet, registrations use faces nobody is
+    registered with.
+    """
+
+    def __init__(self, faces):
+        self.unregistered = list(faces)
+        random.shuffle(self.unregistered)
+        self.students = {}
+        self.checked_in_at = {}
+
+    def next_unregistered(self):
+        return self.unregistered.pop() if self.unregistered else None
+
+    def add_student(self, name, face):
+        self.students[name] = face
+
+    def next_check_in(self):
+        """(name, face) of a student free to check in, reserved for the caller, or None."""
+        now = time.monotonic()
+        fresh = [name for name in self.students
+                 if now - self.checked_in_at.get(name, -CHECK_IN_COOLDOWN_SECONDS) >= CHECK_IN_COOLDOWN_SECONDS]
+        if not fresh:
+            return None
+        name = random.choice(fresh)
+        self.checked_in_at[name] = now
+        return name, self.students[name]
+
+    def any_student(self):
+        return random.choice(list(self.students.items())) if self.students else None
+
+    def reset_check_ins(self):
+        self.checked_in_at.clear()
+
+
+class Stats:
+    """Latencies and outcomes per endpoint for one concurrency level."""
+
+    def __init__(self):
+        self.latencies = collections.defaultdict(list)
+        self.outcomes = collections.defaultdict(collections.Counter)
+        self.started = time.perf_counter()
+        self.elapsed = None
+        self.notes = collections.Counter()
+
+    def record(self, endpoint, start, outcome):
+        self.latencies[endpoint].append((time.perf_counter() - start) * 1000)
+        self.outcomes[endpoint][outcome] += 1
+
+    def stop(self):
+        self.elapsed = time.perf_counter() - self.started
+
+    def report(self):
+        rows = {}
+        for endpoint, latencies in sorted(self.latencies.items()):
+            p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+            errors = {outcome: count for outcome, count in self.outcomes[endpoint].items() if outcome != "ok"}
+            rows[endpoint] = {
+                "requests": len(latencies),
+                "rps": round(len(latencies) / self.elapsed, 2),
+                "p50_ms": round(float(p50), 1),
+                "p95_ms": round(float(p95), 1),
+                "p99_ms": round(float(p99), 1),
+                "errors": errors,
+            }
+        return rows
+
+
+def outcome_of(response):
+    if response.status_code >= 400:
+        return str(response.status_code)
+    try:
+        body = response.json()
+    except ValueError:
+        return "ok"
+    if body.get("name") == "Attendance canceled":
+        return "cooldown"
+    status = body.get("status")
+    return f"{response.status_code}:{status}" if status in FAILURE_STATUSES else "ok"
+
+
+async def timed_post(client, stats, endpoint, **kwargs):
+    start = time.perf_counter()
+    try:
+        response = await client.post(endpoint, **kwargs)
+    except httpx.HTTPError as e:
+        stats.record(endpoint, start, f"exc:{type(e).__name__}")
+        return None
+    stats.record(endpoint, start, outcome_of(response))
+    return response
+
+
+async def check_in(client, stats, identities, faces):
+    """A kiosk check-in: recognize, then mark the recognized student."""
+    student = identities.next_check_in()
+    if student is None:
+        # Every seeded student is in the cooldown, this one shows up as `cooldown`
+        stats.notes["check-ins without a fresh student"] += 1
+        student = identities.any_student()
+    face = student[1] if student is not None else random.choice(faces)
+    response = await timed_post(client, stats, "/api/recognize", files={"image_data": ("face.jpg", face, "image/jpeg")})
+    if response is None or response.status_code != 200:
+        return
+    result = response.json()
+    if result.get("name") in (None, "Unknown", "Attendance canceled"):
+        return
+    await timed_post(
+        client, stats, "/api/mark",
+        data={"name": result["name"], "group": result["group"], "attended": "true"},
+        files={"image_data": ("face.jpg", face, "image/jpeg")},
+    )
+
+
+async def register(client, stats, identities, face):
+    name = f"lt{uuid.uuid4().hex[:10]}"
+    response = await timed_post(
+        client, stats, "/api/register",
+        data={"name": name, "group": LOADTEST_GROUP},
+        files={"image": ("face.jpg", face, "image/jpeg")},
+    )
+    if response is not None and response.status_code == 200:
+        identities.add_student(name, face)
+
+
+async def register_pdf(client, stats, face, job_timeout):
+    """Upload a PDF and follow its job, recorded as `pdf_job`."""
+    start = time.perf_counter()
+    filename = f"lt{uuid.uuid4().hex[:10]}-{LOADTEST_GROUP}.pdf"
+    pdf = make_pdf(face)
+    response = await timed_post(client, stats, "/api/register_from_pdf", files={"pdf_file": (filename, pdf, "application/pdf")})
+    if response is None or response.status_code >= 400:
+        return
+    job_id = response.json()["job_id"]
+    while time.perf_counter() - start < job_timeout:
+        await asyncio.sleep(JOB_POLL_SECONDS)
+        try:
+            job = (await client.get(f"/api/jobs/{job_id}")).json()
+        except (httpx.HTTPError, ValueError):
+            continue
+        if job.get("status") in ("done", "failed"):
+            result_status = (job.get("result") or {}).get("status")
+            ok = job["status"] == "done" and result_status == "success"
+            stats.record("pdf_job", start, "ok" if ok else f"{job['status']}:{result_status or job.get('error')}")
+            return
+    stats.record("pdf_job", start, "timeout")
+
+
+async def virtual_user(client, stats, args, identities, faces, deadline, jobs):
+    """Check-ins come in bursts (a class arriving), with the odd registration."""
+    while time.perf_counter() < deadline:
+        for _ in range(args.burst):
+            action = random.random()
+            # Registrations need a face nobody has, without one it is a check-in
+            face = identities.next_unregistered() if action < args.pdf_ratio + args.register_ratio else None
+            if action < args.pdf_ratio + args.register_ratio and face is None:
+                stats.notes["registrations without an unused face"] += 1
+            if face is not None and action < args.pdf_ratio:
+                jobs.append(asyncio.create_task(register_pdf(client, stats, face, args.job_timeout)))
+            elif face is not None:
+                await register(client, stats, identities, face)
+            else:
+                await check_in(client, stats, identities, faces)
+            if time.perf_counter() >= deadline:
+                break
+        await asyncio.sleep(random.expovariate(1 / args.burst_gap) if args.burst_gap > 0 else 0)
+
+
+async def run_level(client, args, identities, faces, concurrency):
+    stats = Stats()
+    jobs = []
+    deadline = time.perf_counter() + args.duration
+    await asyncio.gather(*(virtual_user(client, stats, args, identities, faces, deadline, jobs) for _ in range(concurrency)))
+    stats.stop()
+    # PDF jobs finish in the background, their latency is reported separately
+    if jobs:
+        await asyncio.gather(*jobs)
+    return stats
+
+
+async def seed(client, identities, count):
+    """Register students so recognize has a gallery to match against."""
+    stats = Stats()
+    for _ in range(count):
+        face = identities.next_unregistered()
+        if face is None:
+            break
+        await register(client, stats, identities, face)
+    print(f"Seeded {len(stats.latencies['/api/register'])} students: {dict(stats.outcomes['/api/register'])}")
+
+
+def in_process_app(data_root):
+    """The app with an in-memory Mongo stand-in, no database needed; returns (app, db).
+
+    Check-in photos (and their compaction) go under `data_root` instead of images/attend.
+    """
+    try:
+        import mongomock
+    except ImportError:
+        raise SystemExit("--in-process needs mongomock (pip install mongomock)")
+    import database
+
+    mongo = mongomock.MongoClient()
+    database.mongo_client = lambda: mongo
+    import main
+    from image_store import AttendanceImageStore
+    main.attendance_images = AttendanceImageStore(os.path.join(data_root, "attend"))
+    return main.app, mongo["attendance"]
+
+
+def clear_attendance(db):
+    """Forget the previous level's check-ins, so every seeded student can check in again."""
+    import rollups
+    for name in ("attendance", rollups.DAILY_COLLECTION, rollups.MONTHLY_COLLECTION):
+        db[name].delete_many({})
+
+
+def print_report(concurrency, rows, notes):
+    print(f"\nconcurrency={concurrency}")
+    print(f"{'endpoint':<26} {'requests':>8} {'rps':>8} {'p50_ms':>9} {'p95_ms':>9} {'p99_ms':>9}  errors")
+    for endpoint, row in rows.items():
+        errors = " ".join(f"{outcome}x{count}" for outcome, count in sorted(row["errors"].items(), key=lambda e: -e[1])) or "-"
+        print(f"{endpoint:<26} {row['requests']:>8} {row['rps']:>8} {row['p50_ms']:>9} {row['p95_ms']:>9} {row['p99_ms']:>9}  {errors}")
+    for note, count in notes.items():
+        print(f"  {note}: {count} (seed more students or add faces for clean numbers)")
+
+
+async def run(args):
+    random.seed(args.seed)
+    faces = load_faces(args.faces)
+    identities = Identities(faces)
+
+    data_root = None
+    if args.url:
+        transport = None
+        base_url = args.url.rstrip("/")
+        if len(args.concurrency) > 1:
+            print("Check-ins stay in the server's 1-hour cooldown, later levels only use students not checked in yet")
+    else:
+        data_root = tempfile.mkdtemp(prefix="loadtest-")
+        app, db = in_process_app(data_root)
+        # httpx does not run the ASGI lifespan, start the job workers ourselves
+        for handler in app.router.on_startup:
+            await handler()
+        transport = httpx.ASGITransport(app=app)
+        base_url = "http://loadtest"
+
+    results = {}
+    async with httpx.AsyncClient(transport=transport, base_url=base_url, timeout=args.timeout) as client:
+        if args.seed_students:
+            await seed(client, identities, args.seed_students)
+        for concurrency in args.concurrency:
+            if not args.url:
+                clear_attendance(db)
+                identities.reset_check_ins()
+            stats = await run_level(client, args, identities, faces, concurrency)
+            results[concurrency] = {"endpoints": stats.report(), "notes": dict(stats.notes)}
+            print_report(concurrency, results[concurrency]["endpoints"], stats.notes)
+
+    if not args.url:
+        # Registered images are written to disk even with the in-memory database
+        shutil.rmtree(os.path.join("images", "registered", LOADTEST_GROUP), ignore_errors=True)
+        shutil.rmtree(data_root, ignore_errors=True)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Replay check-in traffic against the service at increasing concurrency")
+    parser.add_argument('--url', type=str, help="running service to test (registers students into its database, "
+                                                "use a staging instance); default runs the app in-process on mongomock")
+    parser.add_argument('--faces', type=str, default=os.path.join('images', 'registered'),
+                        help="folder of face images used as uploads")
+    parser.add_argument('--concurrency', nargs='*', type=int, default=[1, 2, 4, 8, 16])
+    parser.add_argument('--duration', type=float, default=30.0, help="seconds per concurrency level")
+    parser.add_argument('--burst', type=int, default=5, help="check-ins per user back to back")
+    parser.add_argument('--burst-gap', type=float, default=2.0, help="mean idle seconds between a user's bursts")
+    parser.add_argument('--register-ratio', type=float, default=0.03)
+    parser.add_argument('--pdf-ratio', type=float, default=0.01)
+    parser.add_argument('--seed-students', type=int, default=50,
+                        help="students registered before the sweep; each checks in once per level, the "
+                             "remaining faces are used for registrations")
+    parser.add_argument('--timeout', type=float, default=60.0, help="client timeout per request")
+    parser.add_argument('--job-timeout', type=float, default=300.0, help="how long to follow a PDF job")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', type=str, help="also write the results to this file")
+    args = parser.parse_args()
+    asyncio.run(run(args))
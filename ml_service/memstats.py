@@ -0,0 +1,76 @@
+import argparse
+import os
+
+SMAPS_FIELDS = ("Rss", "Pss", "Shared_Clean", "Shared_Dirty", "Private_Clean", "Private_Dirty")
+
+
+def process_memory(pid="self"):
+    """Memory of one process in kB, from /proc/<pid>/smaps_rollup.
+
+    Pss splits shared pages between the processes mapping them, so summing Pss
+    over the workers gives the real footprint while summing Rss counts the
+    copy-on-write model weights once per worker.
+    """
+    stats = {"pid": os.getpid() if pid == "self" else int(pid)}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                parts = line.split()
+                key = parts[0].rstrip(":")
+                if key in SMAPS_FIELDS:
+                    stats[key] = int(parts[1])
+    except OSError:
+        # Older kernels: fall back to plain RSS
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    stats["Rss"] = int(line.split()[1])
+    return stats
+
+
+def child_pids(pid):
+    pids = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # The command name is in parentheses and may contain spaces
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        if ppid == pid:
+            pids.append(int(entry))
+    return sorted(pids)
+
+
+def worker_memory(master_pid=None):
+    """Memory of the gunicorn master and each of its workers."""
+    if master_pid is None:
+        if os.environ.get("ML_SERVICE_WORKERS") is None:
+            return {"master": None, "workers": [process_memory()]}
+        master_pid = os.getppid()
+    workers = []
+    for pid in child_pids(master_pid):
+        try:
+            workers.append(process_memory(pid))
+        except OSError:
+            continue
+    report = {"master": process_memory(master_pid), "workers": workers}
+    report["total_rss_kb"] = sum(w.get("Rss", 0) for w in workers)
+    report["total_pss_kb"] = sum(w.get("Pss", 0) for w in workers)
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Report per-worker memory of a gunicorn master")
+    parser.add_argument('master_pid', type=int, help="pid of the gunicorn master")
+    args = parser.parse_args()
+
+    report = worker_memory(args.master_pid)
+    print(f"{'pid':>8} {'rss_kb':>10} {'pss_kb':>10} {'shared_kb':>10} {'private_kb':>10}")
+    for w in [report["master"]] + report["workers"]:
+        shared = w.get("Shared_Clean", 0) + w.get("Shared_Dirty", 0)
+        private = w.get("Private_Clean", 0) + w.get("Private_Dirty", 0)
+        print(f"{w['pid']:>8} {w.get('Rss', 0):>10} {w.get('Pss', 0):>10} {shared:>10} {private:>10}")
+    print(f"workers: sum rss {report['total_rss_kb']} kB, sum pss {report['total_pss_kb']} kB")
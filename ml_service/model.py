@@ -1,6 +1,8 @@
+import os
+
 import torch
 import torch.nn as nn
-from torchvision.models import resnet50
+from torchvision.models import resnet18, resnet50, mobilenet_v3_small
 
 try:
     from torch.hub import load_state_dict_from_url
@@ -34,10 +36,21 @@ def model_921(pretrained=True, progress=True):
     return model
 
 
+def l2_norm(input):
+    input_size = input.size()
+    buffer = torch.pow(input, 2)
+    normp = torch.sum(buffer, 1).add_(1e-10)
+    norm = torch.sqrt(normp)
+    _output = torch.div(input, norm.view(-1, 1).expand_as(input))
+    output = _output.view(input_size)
+    return output
+
+
 class Flatten(nn.Module):
 
     def forward(self, x):
-        return x.view(x.size(0), -1)
+        # reshape rather than view, channels_last activations are not contiguous
+        return x.reshape(x.size(0), -1)
 
 
 class FaceNetModel(nn.Module):
@@ -69,13 +82,7 @@ class FaceNetModel(nn.Module):
         self.model.classifier = nn.Linear(embedding_size, num_classes)
 
     def l2_norm(self, input):
-        input_size = input.size()
-        buffer = torch.pow(input, 2)
-        normp = torch.sum(buffer, 1).add_(1e-10)
-        norm = torch.sqrt(normp)
-        _output = torch.div(input, norm.view(-1, 1).expand_as(input))
-        output = _output.view(input_size)
-        return output
+        return l2_norm(input)
 
     def freeze_all(self):
         for param in self.model.parameters():
@@ -125,4 +132,69 @@ class FaceNetModel(nn.Module):
     def forward_classifier(self, x):
         features = self.forward(x)
         res = self.model.classifier(features)
-        return res
\ No newline at end of file
+        return res
+
+
+class EmbeddingModel(nn.Module):
+    """Small embedder with the same output as FaceNetModel.
+
+    Global-average-pooled trunk with a 128-d linear head, so the head is a
+    few hundred thousand weights instead of FaceNetModel's 100352x128.
+    Embeddings are L2 normalised and scaled by alpha = 10 like FaceNetModel,
+    so distances and thresholds stay on the same scale.
+    """
+
+    def __init__(self, trunk='resnet18', embedding_size=128):
+        super(EmbeddingModel, self).__init__()
+
+        if trunk == 'resnet18':
+            net = resnet18()
+            self.cnn = nn.Sequential(*list(net.children())[:-2])
+            channels = 512
+        elif trunk == 'mobilenet_v3_small':
+            net = mobilenet_v3_small()
+            self.cnn = net.features
+            channels = 576
+        else:
+            raise ValueError(f"Unknown trunk: {trunk}")
+
+        self.pool = nn.AdaptiveAvgPool2d(1)
+        self.fc = nn.Sequential(
+            Flatten(),
+            nn.Linear(channels, embedding_size))
+
+    def forward(self, x):
+        x = self.cnn(x)
+        x = self.pool(x)
+        x = self.fc(x)
+
+        features = l2_norm(x)
+        alpha = 10
+        features = features * alpha
+        return features
+
+
+# Embedding backbones selectable with EMBEDDING_BACKBONE. input_size is the
+# square face crop each one is trained on. Only the facenet_resnet50 weights
+# ship in models/; the smaller backbones have to be trained separately and
+# their checkpoints put at these paths (or set with <NAME>_CHECKPOINT).
+BACKBONES = dict(
+    facenet_resnet50=dict(
+        build=FaceNetModel,
+        input_size=224,
+        checkpoint=os.environ.get("FACENET_RESNET50_CHECKPOINT", './models/models_0821_50.pth')),
+    resnet18=dict(
+        build=lambda: EmbeddingModel('resnet18'),
+        input_size=112,
+        checkpoint=os.environ.get("RESNET18_CHECKPOINT", './models/embedder_resnet18.pth')),
+    mobilenet_v3_small=dict(
+        build=lambda: EmbeddingModel('mobilenet_v3_small'),
+        input_size=112,
+        checkpoint=os.environ.get("MOBILENET_V3_SMALL_CHECKPOINT", './models/embedder_mobilenet_v3_small.pth')),
+)
+
+
+def build_backbone(name):
+    if name not in BACKBONES:
+        raise ValueError(f"Unknown embedding backbone: {name}, use one of {sorted(BACKBONES)}")
+    return BACKBONES[name]['build']()
\ No newline at end of file
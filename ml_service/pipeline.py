@@ -0,0 +1,230 @@
+import logging
+import os
+import threading
+
+import dlib
+import numpy as np
+import torch
+import torchvision.transforms as transforms
+from PIL import Image
+
+import runtime_tuning
+from alignment import align_face
+from gallery import LEGACY_EMBEDDING_VERSION
+from model import BACKBONES, build_backbone
+from yoloV8 import YOLOv8_face
+
+# Embedding model, see model.BACKBONES. Changing either setting changes the
+# embedding version, so the gallery has to be re-embedded first.
+EMBEDDING_BACKBONE = os.environ.get("EMBEDDING_BACKBONE", "facenet_resnet50")
+FACE_ALIGN = os.environ.get("FACE_ALIGN", "0") == "1"
+MODEL_PATH = os.environ.get("EMBEDDING_CHECKPOINT") or BACKBONES[EMBEDDING_BACKBONE]['checkpoint']
+YOLO_MODEL_PATH = "models/yolov8n-face.onnx"
+PREDICTOR_PATH = "models/shape_predictor_68_face_landmarks.dat"
+
+# Detector input sizes: kiosk selfies have one large face and are run at the
+# small size first, group photos and PDF scans at the full size
+YOLO_SELFIE_SIZE = int(os.environ.get("YOLO_SELFIE_SIZE", "320"))
+YOLO_GROUP_SIZE = 640
+YOLO_INPUT_SIZES = (YOLO_SELFIE_SIZE, YOLO_GROUP_SIZE)
+DETECTION_MODES = ("selfie", "group")
+# Without an explicit mode, uploads whose original long side (before the
+# INGEST_MAX_SIDE downscale) is at most this are treated as selfies
+YOLO_SELFIE_MAX_SIDE = int(os.environ.get("YOLO_SELFIE_MAX_SIDE", "1280"))
+
+device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+# Models are loaded once per process (or once in the parent before forking
+# workers) instead of on every request
+_face_detectors = {}
+_landmark_models = {}
+_embedders = {}
+_load_lock = threading.Lock()
+# cv2.dnn nets keep their input blob on the object, so detection is serialised
+yolo_lock = threading.Lock()
+
+
+def load_model(pretrained=True, model_path=None, backbone=EMBEDDING_BACKBONE):
+    if model_path is None:
+        model_path = MODEL_PATH if backbone == EMBEDDING_BACKBONE else BACKBONES[backbone]['checkpoint']
+    try:
+        model = build_backbone(backbone)
+        if pretrained:
+            if not os.path.exists(model_path):
+                raise FileNotFoundError(f"No checkpoint for the {backbone} backbone at {model_path}, "
+                                        f"set {backbone.upper()}_CHECKPOINT (see model.BACKBONES)")
+            logging.info("Loading model weights...")
+
+            try:
+                checkpoint = torch.load(
+                    model_path,
+                    weights_only=True,
+                    map_location=device
+                )
+                logging.info("Successfully loaded model with weights_only=True")
+            except Exception as e:
+                logging.warning(f"Failed to load with weights_only=True: {e}")
+                logging.info("Attempting to load model without weights_only...")
+
+                checkpoint = torch.load(
+                    model_path,
+                    map_location=device
+                )
+                logging.info("Successfully loaded model without weights_only")
+
+            if isinstance(checkpoint, dict):
+                if 'state_dict' in checkpoint:
+                    model.load_state_dict(checkpoint['state_dict'])
+                else:
+                    model.load_state_dict(checkpoint)
+            else:
+                raise ValueError("Unexpected checkpoint format")
+
+            logging.info("Model weights loaded successfully")
+
+        model = model.to(device)
+        model.eval()
+        return model
+
+    except Exception as e:
+        logging.error(f"Error in load_model: {str(e)}")
+        raise RuntimeError(f"Failed to load model: {str(e)}")
+
+
+def get_face_detector(model_path=YOLO_MODEL_PATH, conf_thres=0.45, iou_thres=0.5):
+    key = (model_path, conf_thres, iou_thres)
+    detector = _face_detectors.get(key)
+    if detector is None:
+        with _load_lock:
+            detector = _face_detectors.get(key)
+            if detector is None:
+                logging.info(f"Loading face detector {model_path}")
+                detector = YOLOv8_face(model_path, conf_thres=conf_thres, iou_thres=iou_thres, input_sizes=YOLO_INPUT_SIZES)
+                _face_detectors[key] = detector
+    return detector
+
+
+def get_landmark_models(predictor_path=PREDICTOR_PATH):
+    models = _landmark_models.get(predictor_path)
+    if models is None:
+        with _load_lock:
+            models = _landmark_models.get(predictor_path)
+            if models is None:
+                logging.info(f"Loading dlib predictor {predictor_path}")
+                models = (dlib.get_frontal_face_detector(), dlib.shape_predictor(predictor_path))
+                _landmark_models[predictor_path] = models
+    return models
+
+
+def choose_input_size(image_shape, mode=None, source_size=None):
+    """Pick the detector input size from the request mode or the image itself.
+
+    `source_size` is the (width, height) of the upload before it was
+    downscaled (ingest.Frame.source_size); decoded frames are capped at
+    INGEST_MAX_SIDE, so their own size says little about what was sent.
+    """
+    if mode == "group":
+        return YOLO_GROUP_SIZE
+    if mode == "selfie":
+        return YOLO_SELFIE_SIZE
+    if mode is not None:
+        raise ValueError(f"Unknown detection mode: {mode}, use 'selfie' or 'group'")
+    height, width = image_shape[:2]
+    long_side = max(source_size) if source_size else max(height, width)
+    # Portrait phone/webcam frames are the kiosk check-in case
+    if height >= width or long_side <= YOLO_SELFIE_MAX_SIDE:
+        return YOLO_SELFIE_SIZE
+    return YOLO_GROUP_SIZE
+
+
+def detect_faces(image, model_path=YOLO_MODEL_PATH, mode=None, rgb=False, source_size=None):
+    """Run YOLO at the size chosen for this image, retrying at full size if nothing is found."""
+    detector = get_face_detector(model_path)
+    input_size = choose_input_size(image.shape, mode, source_size)
+    with yolo_lock:
+        bboxes, confidences, classIds, landmarks = detector.detect(image, input_size=input_size, rgb=rgb)
+        if len(bboxes) == 0 and input_size != YOLO_GROUP_SIZE:
+            logging.info(f"No face at input size {input_size}, retrying at {YOLO_GROUP_SIZE}")
+            bboxes, confidences, classIds, landmarks = detector.detect(image, input_size=YOLO_GROUP_SIZE, rgb=rgb)
+    return bboxes, confidences, classIds, landmarks
+
+
+def embedding_version(backbone=EMBEDDING_BACKBONE, align=FACE_ALIGN):
+    return f"{backbone}-{'aligned' if align else 'crop'}"
+
+
+def parse_embedding_version(version):
+    backbone, _, mode = version.rpartition("-")
+    if backbone not in BACKBONES or mode not in ("aligned", "crop"):
+        raise ValueError(f"Unknown embedding version: {version}")
+    return backbone, mode == "aligned"
+
+
+class Embedder:
+    """Turns detected faces into embeddings with the configured backbone.
+
+    With alignment on, each face is warped to the canonical 5-point template
+    at the backbone's input size; otherwise the YOLO box is cropped, resized
+    and center cropped.
+    """
+
+    def __init__(self, model, backbone=EMBEDDING_BACKBONE, align=FACE_ALIGN):
+        self.model = model
+        self.backbone = backbone
+        self.align = align
+        self.input_size = BACKBONES[backbone]['input_size']
+        self.version = embedding_version(backbone, align)
+        # The legacy gallery was embedded from crops with R and B swapped
+        self.swap_channels = self.version == LEGACY_EMBEDDING_VERSION
+        self.transform = transforms.Compose([
+            transforms.Resize(self.input_size),
+            transforms.CenterCrop(self.input_size),
+            transforms.ToTensor(),
+            transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
+        ])
+
+    def face_input(self, rgb, bbox=None, landmarks=None):
+        """PIL image of one face, ready for the transform.
+
+        `rgb` is the frame, `bbox` the [x1, y1, w, h] YOLO box and `landmarks`
+        its 15-value keypoint row. Without a box the whole image is the face.
+        """
+        if self.align and landmarks is not None:
+            aligned = align_face(rgb, landmarks, self.input_size)
+            if aligned is not None:
+                return Image.fromarray(aligned)
+        face = rgb
+        if bbox is not None:
+            x1, y1, w, h = [int(v) for v in bbox]
+            face = rgb[max(0, y1):y1 + h, max(0, x1):x1 + w]
+        if self.swap_channels:
+            face = face[:, :, ::-1]
+        return Image.fromarray(np.ascontiguousarray(face))
+
+    def embed(self, faces):
+        """Embed a list of face_input() images, returns an (n, 128) array."""
+        batch = torch.stack([self.transform(face) for face in faces]).to(device)
+        with torch.no_grad():
+            features = self.model(batch)
+        return features.cpu().numpy()
+
+
+def embedder_for_version(version, model=None):
+    """Embedder for an embedding version, loading its backbone once per process."""
+    embedder = _embedders.get(version)
+    if embedder is None:
+        with _load_lock:
+            embedder = _embedders.get(version)
+            if embedder is None:
+                backbone, align = parse_embedding_version(version)
+                if model is None:
+                    model = runtime_tuning.optimize_model(load_model(backbone=backbone))
+                embedder = Embedder(model, backbone=backbone, align=align)
+                _embedders[version] = embedder
+    return embedder
+
+
+def preload():
+    """Load the detectors up front so forked workers share them copy-on-write."""
+    get_face_detector()
+    get_landmark_models()
@@ -0,0 +1,241 @@
+import contextlib
+import contextvars
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import threading
+import time
+import uuid
+from datetime import datetime
+
+import torch
+
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "./images/temp/profiles")
+SLOW_REQUEST_DIR = os.environ.get("SLOW_REQUEST_DIR", "./images/temp/slow_requests")
+# Requests slower than this (milliseconds) are saved to the slow-request ring
+SLOW_REQUEST_MS = float(os.environ.get("SLOW_REQUEST_MS", "3000"))
+SLOW_REQUEST_RING_SIZE = int(os.environ.get("SLOW_REQUEST_RING_SIZE", "50"))
+# Run every request under cProfile so slow ones come with profile data.
+# The heavy stages are C/C++ (torch, OpenCV, dlib) so the overhead is small,
+# but cProfile is process-wide: only one request at a time gets profiled,
+# and while one is, an admin's ?profile=1 request runs unprofiled. Off by
+# default, so slow-request entries carry stage timings only.
+SLOW_REQUEST_PROFILE = os.environ.get("SLOW_REQUEST_PROFILE", "0") == "1"
+
+os.makedirs(PROFILE_DIR, exist_ok=True)
+os.makedirs(SLOW_REQUEST_DIR, exist_ok=True)
+
+_stages = contextvars.ContextVar("stages", default=None)
+_profiler = contextvars.ContextVar("profiler", default=None)
+
+# cProfile and the torch profiler are process-wide, only one request at a time
+_profiler_lock = threading.Lock()
+# Kineto allows one torch profiling session per process; a second one cancels
+# the first, so a request with jobs on several ML workers profiles one at a time
+_torch_lock = threading.Lock()
+_ring_lock = threading.Lock()
+_ring_next = None
+
+
+@contextlib.contextmanager
+def stage(name):
+    """Time a pipeline stage and record it on the current request, if any."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stages = _stages.get()
+        if stages is not None:
+            stages.append({"stage": name, "ms": round((time.perf_counter() - start) * 1000, 2)})
+
+
+def start_request():
+    """Start collecting stage timings for the current request."""
+    stages = []
+    _stages.set(stages)
+    return stages
+
+
+def current_stages():
+    return _stages.get()
+
+
+class RequestProfiler:
+    """Runs one request under cProfile and, optionally, the torch profiler.
+
+    Requests interleaved on the event loop while the profiler is active are
+    included in the profile; use it on a quiet instance for clean numbers.
+    Torch only records ops of the thread that started it and all inference
+    runs on the ML workers, so torch profiles come from `profile_thread`.
+    """
+
+    def __init__(self, with_torch=True):
+        self.with_torch = with_torch
+        self.profile = None
+        self.thread_profiles = []
+        self.torch_profiles = []
+        self.active = False
+        self._token = None
+
+    def __enter__(self):
+        if not _profiler_lock.acquire(blocking=False):
+            logging.warning("Profiler already in use, running request without profiling")
+            return self
+        self.active = True
+        self.profile = cProfile.Profile()
+        self.profile.enable()
+        self._token = _profiler.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if not self.active:
+            return False
+        try:
+            self.profile.disable()
+            _profiler.reset(self._token)
+        finally:
+            _profiler_lock.release()
+        return False
+
+    def stats(self, stream=None):
+        """cProfile stats of the request, including work it ran on other threads."""
+        stats = pstats.Stats(self.profile, stream=stream)
+        for profile in self.thread_profiles:
+            stats.add(profile)
+        return stats
+
+    def python_summary(self, limit=40):
+        if self.profile is None:
+            return ""
+        stream = io.StringIO()
+        self.stats(stream).sort_stats("cumulative").print_stats(limit)
+        return stream.getvalue()
+
+    def torch_summary(self, limit=30):
+        return "\n".join(
+            profile.key_averages().table(sort_by="cpu_time_total", row_limit=limit)
+            for profile in self.torch_profiles
+        )
+
+    def save(self, request_info):
+        """Store the profile under PROFILE_DIR and return its id."""
+        profile_id = f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        if self.profile is not None:
+            self.stats().dump_stats(os.path.join(PROFILE_DIR, f"{profile_id}.prof"))
+        report = dict(request_info)
+        report["python_profile"] = self.python_summary()
+        report["torch_profile"] = self.torch_summary()
+        with open(os.path.join(PROFILE_DIR, f"{profile_id}.json"), "w") as f:
+            json.dump(report, f)
+        logging.info(f"Saved request profile {profile_id}")
+        return profile_id
+
+
+@contextlib.contextmanager
+def profile_thread():
+    """Profile work the current request runs on another thread.
+
+    cProfile and the torch profiler only see the thread that enabled them, so
+    threads doing work on behalf of a profiled request (see scheduler.py)
+    collect their own profiles and hand them back to the request's profiler.
+    """
+    profiler = _profiler.get()
+    if profiler is None or not profiler.active:
+        yield
+        return
+    with contextlib.ExitStack() as stack:
+        if profiler.with_torch and _torch_lock.acquire(blocking=False):
+            stack.callback(_torch_lock.release)
+            torch_profile = torch.profiler.profile(
+                activities=[torch.profiler.ProfilerActivity.CPU],
+                record_shapes=True,
+            )
+            # Unwinds in reverse: the profile stops, is handed over, then the lock goes
+            stack.callback(profiler.torch_profiles.append, torch_profile)
+            stack.enter_context(torch_profile)
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            profiler.thread_profiles.append(profile)
+
+
+def load_profile(profile_id):
+    # Ids are generated by RequestProfiler.save, never accept path components
+    if os.path.basename(profile_id) != profile_id:
+        return None
+    path = os.path.join(PROFILE_DIR, f"{profile_id}.json")
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def _next_ring_slot():
+    global _ring_next
+    with _ring_lock:
+        if _ring_next is None:
+            # Resume after the most recently written slot
+            slots = _ring_paths()
+            if slots:
+                newest = max(slots, key=os.path.getmtime)
+                _ring_next = int(os.path.splitext(os.path.basename(newest))[0][len("slow_"):]) + 1
+            else:
+                _ring_next = 0
+        slot = _ring_next % SLOW_REQUEST_RING_SIZE
+        _ring_next = slot + 1
+        return slot
+
+
+def _ring_paths():
+    return [
+        os.path.join(SLOW_REQUEST_DIR, name)
+        for name in os.listdir(SLOW_REQUEST_DIR)
+        if name.startswith("slow_") and name.endswith(".json")
+    ]
+
+
+def record_slow_request(request_info, profiler=None):
+    """Write a slow request into the next slot of the on-disk ring."""
+    record = dict(request_info)
+    if profiler is not None and profiler.active:
+        record["python_profile"] = profiler.python_summary()
+        record["torch_profile"] = profiler.torch_summary()
+    slot = _next_ring_slot()
+    path = os.path.join(SLOW_REQUEST_DIR, f"slow_{slot:03d}.json")
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(record, f)
+    os.replace(tmp_path, path)
+    logging.warning(f"Slow request {record['method']} {record['path']} took {record['elapsed_ms']} ms, saved to {path}")
+
+
+def list_slow_requests():
+    records = []
+    for path in _ring_paths():
+        try:
+            with open(path) as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            continue
+        record.pop("python_profile", None)
+        record.pop("torch_profile", None)
+        record["slot"] = os.path.basename(path)
+        records.append(record)
+    records.sort(key=lambda r: r["timestamp"], reverse=True)
+    return records
+
+
+def load_slow_request(slot):
+    if os.path.basename(slot) != slot or not slot.startswith("slow_"):
+        return None
+    path = os.path.join(SLOW_REQUEST_DIR, slot)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
@@ -0,0 +1,118 @@
+import math
+import os
+
+import cv2
+import numpy as np
+
+from alignment import landmark_points
+
+# Checked right after YOLO so hopeless frames never reach dlib and the embedder
+QUALITY_GATE = os.environ.get("QUALITY_GATE", "1") == "1"
+# Shorter side of the face box, in decoded-frame pixels (see INGEST_MAX_SIDE)
+QUALITY_MIN_FACE_PX = int(os.environ.get("QUALITY_MIN_FACE_PX", "64"))
+# Variance of the Laplacian of the face resized to QUALITY_SAMPLE_WIDTH
+QUALITY_MIN_SHARPNESS = float(os.environ.get("QUALITY_MIN_SHARPNESS", "30"))
+# Mean gray level of the face, 0-255
+QUALITY_MIN_BRIGHTNESS = float(os.environ.get("QUALITY_MIN_BRIGHTNESS", "50"))
+QUALITY_MAX_BRIGHTNESS = float(os.environ.get("QUALITY_MAX_BRIGHTNESS", "210"))
+QUALITY_MIN_CONFIDENCE = float(os.environ.get("QUALITY_MIN_CONFIDENCE", "0.5"))
+# Nose offset from the eye midpoint in inter-eye distances, and eye-line tilt
+QUALITY_MAX_YAW = float(os.environ.get("QUALITY_MAX_YAW", "0.45"))
+QUALITY_MAX_ROLL_DEGREES = float(os.environ.get("QUALITY_MAX_ROLL_DEGREES", "30"))
+# Nose height between the eyes (0) and the mouth (1); about 0.5 when facing the camera
+QUALITY_PITCH_RANGE = (0.2, 0.8)
+QUALITY_SAMPLE_WIDTH = 112
+
+# Reason -> (status code, message); 477/478 are the existing no face/several faces codes
+REJECTIONS = {
+    "face_too_small": (480, "Face too small, please move closer to the camera."),
+    "blurry": (481, "Image is blurry, please hold still."),
+    "too_dark": (482, "Image is too dark, please find better light."),
+    "too_bright": (483, "Image is too bright, please avoid direct light."),
+    "low_confidence": (484, "Face not clearly visible."),
+    "bad_pose": (485, "Please look straight at the camera."),
+}
+
+
+class QualityError(Exception):
+    """A frame that cannot give a usable embedding, with the reason and status code."""
+
+    def __init__(self, reason, metrics):
+        self.reason = reason
+        self.status_code, self.message = REJECTIONS[reason]
+        self.metrics = metrics
+        super().__init__(self.message)
+
+    def response(self):
+        # JSON has no NaN/inf, degenerate keypoints give those
+        metrics = {key: value if np.isfinite(value) else None for key, value in self.metrics.items()}
+        return {"status": "error", "code": self.reason, "message": self.message, "quality": metrics}
+
+
+def pose(landmarks):
+    """(yaw, pitch, roll_degrees) estimated from YOLO's 5 keypoints."""
+    left_eye, right_eye, nose, left_mouth, right_mouth = landmark_points(landmarks)
+    eye_mid = (left_eye + right_eye) / 2
+    eye_vector = right_eye - left_eye
+    eye_distance = float(np.linalg.norm(eye_vector))
+    if eye_distance < 1e-6:
+        return float("inf"), float("nan"), float("nan")
+    roll = math.atan2(eye_vector[1], eye_vector[0])
+
+    # Measure in the face's own frame so a tilted head does not look turned
+    cos, sin = math.cos(-roll), math.sin(-roll)
+    rotation = np.array([[cos, -sin], [sin, cos]], dtype=np.float32)
+    nose_offset = rotation @ (nose - eye_mid)
+    mouth_offset = rotation @ ((left_mouth + right_mouth) / 2 - eye_mid)
+
+    yaw = float(nose_offset[0] / eye_distance)
+    pitch = float(nose_offset[1] / mouth_offset[1]) if mouth_offset[1] > 1e-6 else float("nan")
+    return yaw, pitch, math.degrees(roll)
+
+
+def sharpness(gray_face):
+    """Variance of the Laplacian, on the face resized to QUALITY_SAMPLE_WIDTH."""
+    height, width = gray_face.shape[:2]
+    if width == 0 or height == 0:
+        return 0.0
+    sample = gray_face
+    if width != QUALITY_SAMPLE_WIDTH:
+        # A fixed size keeps sharpness comparable between near and far faces
+        sample_height = max(1, round(height * QUALITY_SAMPLE_WIDTH / width))
+        sample = cv2.resize(gray_face, (QUALITY_SAMPLE_WIDTH, sample_height), interpolation=cv2.INTER_AREA)
+    return round(float(cv2.Laplacian(sample, cv2.CV_64F).var()), 1)
+
+
+def measure(gray_face, bbox, confidence, landmarks):
+    """Metrics of every check but sharpness, which needs a resample and a filter."""
+    yaw, pitch, roll = pose(landmarks)
+    return {
+        "face_px": int(min(bbox[2], bbox[3])),
+        "confidence": round(float(confidence), 3),
+        "brightness": round(float(gray_face.mean()), 1) if gray_face.size else 0.0,
+        "yaw": round(yaw, 3),
+        "pitch": round(pitch, 3),
+        "roll": round(roll, 1),
+    }
+
+
+def check(gray_face, bbox, confidence, landmarks):
+    """Raise QualityError for the first failed check, cheapest first; returns the metrics."""
+    metrics = measure(gray_face, bbox, confidence, landmarks)
+    if metrics["face_px"] < QUALITY_MIN_FACE_PX:
+        raise QualityError("face_too_small", metrics)
+    if metrics["confidence"] < QUALITY_MIN_CONFIDENCE:
+        raise QualityError("low_confidence", metrics)
+    pitch_low, pitch_high = QUALITY_PITCH_RANGE
+    if (abs(metrics["yaw"]) > QUALITY_MAX_YAW or abs(metrics["roll"]) > QUALITY_MAX_ROLL_DEGREES
+            or not pitch_low <= metrics["pitch"] <= pitch_high):
+        raise QualityError("bad_pose", metrics)
+    if metrics["brightness"] < QUALITY_MIN_BRIGHTNESS:
+        raise QualityError("too_dark", metrics)
+    if metrics["brightness"] > QUALITY_MAX_BRIGHTNESS:
+        raise QualityError("too_bright", metrics)
+    # Only frames that passed everything else pay for the sharpness measure
+    metrics["sharpness"] = sharpness(gray_face)
+    if metrics["sharpness"] < QUALITY_MIN_SHARPNESS:
+        raise QualityError("blurry", metrics)
+    return metrics
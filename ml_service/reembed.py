@@ -0,0 +1,229 @@
+import argparse
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import numpy as np
+from pymongo import UpdateOne
+
+import ingest
+import pipeline
+from gallery import activate_embedding_version, embedding_field
+
+REGISTERED_DIR = os.path.join('images', 'registered')
+REEMBED_BATCH_SIZE = int(os.environ.get("REEMBED_BATCH_SIZE", "64"))
+# Faces per detection/embedding call; in the service each call is one bulk
+# job on the inference queue, so check-ins never wait behind a whole batch
+REEMBED_ML_BATCH_SIZE = int(os.environ.get("REEMBED_ML_BATCH_SIZE", "8"))
+
+
+def run_inline(fn, *args):
+    return fn(*args)
+
+
+def registered_image_path(name, group, images_dir=REGISTERED_DIR):
+    return os.path.join(images_dir, group, f"{name}-{group}.jpg")
+
+
+class ReembedJob:
+    """Re-embeds every registered student into another embedding version.
+
+    Reads the images saved under images/registered/<group>/ and writes the
+    result to the version's own field, next to the embeddings in use, so
+    recognition keeps working until `activate` switches all workers over.
+
+    The job is resumable: students that already have the target field are
+    skipped, and progress (counts, last id, images/second) is checkpointed
+    after every batch in the `meta` collection under `reembed:<version>`.
+
+    Students registered before `image_channels` was recorded are told apart
+    by how their legacy `features` were stored: /api/register saved a flat
+    list and an R/B-swapped crop, /api/register/pdf a nested [[...]] list and
+    the uploaded image in true RGB. `legacy_channels` only applies to the
+    former.
+    """
+
+    def __init__(self, db, embedding_version, images_dir=REGISTERED_DIR, batch_size=REEMBED_BATCH_SIZE,
+                 legacy_channels="bgr", decode_workers=4, ml_batch_size=REEMBED_ML_BATCH_SIZE, run_ml=run_inline):
+        self.students_collection = db["students"]
+        self.meta_collection = db["meta"]
+        self.embedding_version = embedding_version
+        self.field = embedding_field(embedding_version)
+        self.progress_id = f"reembed:{embedding_version}"
+        self.images_dir = images_dir
+        self.batch_size = batch_size
+        # Channel order of images saved by /api/register before image_channels was recorded
+        self.legacy_channels = legacy_channels
+        self.decode_workers = decode_workers
+        self.ml_batch_size = ml_batch_size
+        # run_ml(fn, *args) runs detection and embedding; the service passes
+        # its inference queue so re-embedding yields to live traffic
+        self.run_ml = run_ml
+        self.embedder = None
+        self.stop_requested = False
+
+    def pending_query(self):
+        return {self.field: {"$exists": False}}
+
+    def progress(self):
+        return self.meta_collection.find_one({"_id": self.progress_id})
+
+    def image_channels(self, doc):
+        """Channel order of a student's saved image, see the class docstring."""
+        if "image_channels" in doc:
+            return doc["image_channels"]
+        features = doc.get("features")
+        if features and isinstance(features[0], list):
+            return "rgb"
+        return self.legacy_channels
+
+    def load_image(self, doc):
+        """Decode one registered image as RGB, returns (image, error)."""
+        try:
+            path = registered_image_path(doc["name"], doc["group"], self.images_dir)
+            if not os.path.exists(path):
+                return None, f"missing image {path}"
+            rgb = ingest.load_frame(path).rgb
+            if self.image_channels(doc) == "bgr":
+                rgb = np.ascontiguousarray(rgb[:, :, ::-1])
+            return rgb, None
+        except Exception as e:
+            return None, str(e)
+
+    def face_input(self, rgb):
+        # Saved images are already face crops, detection only finds the keypoints
+        bbox = landmarks = None
+        if self.embedder.align:
+            bboxes, _, _, face_landmarks = pipeline.detect_faces(rgb, mode="selfie", rgb=True)
+            if len(bboxes) > 0:
+                bbox, landmarks = bboxes[0], face_landmarks[0]
+        return self.embedder.face_input(rgb, bbox, landmarks)
+
+    def embed_images(self, images):
+        """(embedding, error) for each decoded image, one of them None."""
+        inputs, errors = [], []
+        for rgb in images:
+            try:
+                inputs.append(self.face_input(rgb))
+                errors.append(None)
+            except Exception as e:
+                inputs.append(None)
+                errors.append(str(e))
+        faces = [face for face in inputs if face is not None]
+        embeddings = iter(self.embedder.embed(faces) if faces else [])
+        return [(next(embeddings) if face is not None else None, error) for face, error in zip(inputs, errors)]
+
+    def run(self):
+        self.embedder = pipeline.embedder_for_version(self.embedding_version)
+        query = self.pending_query()
+        pending = self.students_collection.count_documents(query)
+        self.meta_collection.update_one(
+            {"_id": self.progress_id},
+            {
+                "$set": {"status": "running", "pending": pending, "updated_at": datetime.now()},
+                "$setOnInsert": {"embedding_version": self.embedding_version, "started_at": datetime.now(), "done": 0, "failed": 0},
+            },
+            upsert=True,
+        )
+        logging.info(f"Re-embedding {pending} students into {self.embedding_version}")
+
+        processed = 0
+        start = time.perf_counter()
+        last_id = None
+        with ThreadPoolExecutor(self.decode_workers) as pool:
+            while not self.stop_requested:
+                batch_query = dict(query)
+                if last_id is not None:
+                    batch_query["_id"] = {"$gt": last_id}
+                docs = list(
+                    self.students_collection.find(batch_query, {"name": 1, "group": 1, "image_channels": 1, "features": {"$slice": 1}})
+                    .sort("_id", 1)
+                    .limit(self.batch_size)
+                )
+                if not docs:
+                    break
+                last_id = docs[-1]["_id"]
+
+                # Decoding runs in parallel, detection and embedding in small ML batches
+                decoded = list(pool.map(self.load_image, docs))
+                results = [(doc, None, error) for doc, (rgb, error) in zip(docs, decoded) if rgb is None]
+                images = [(doc, rgb) for doc, (rgb, _) in zip(docs, decoded) if rgb is not None]
+                for i in range(0, len(images), self.ml_batch_size):
+                    chunk = images[i:i + self.ml_batch_size]
+                    embedded = self.run_ml(self.embed_images, [rgb for _, rgb in chunk])
+                    results.extend((doc, embedding, error) for (doc, _), (embedding, error) in zip(chunk, embedded))
+
+                faces = [(doc, embedding) for doc, embedding, _ in results if embedding is not None]
+                errors = [f"{doc['name']}-{doc['group']}: {error}" for doc, embedding, error in results if embedding is None]
+                if faces:
+                    self.students_collection.bulk_write([
+                        UpdateOne({"_id": doc["_id"]}, {"$set": {self.field: embedding.tolist()}})
+                        for doc, embedding in faces
+                    ], ordered=False)
+
+                processed += len(docs)
+                rate = processed / (time.perf_counter() - start)
+                self.meta_collection.update_one(
+                    {"_id": self.progress_id},
+                    {
+                        "$inc": {"done": len(faces), "failed": len(errors)},
+                        "$set": {"last_id": last_id, "images_per_second": round(rate, 2), "updated_at": datetime.now()},
+                        "$push": {"errors": {"$each": errors, "$slice": -100}},
+                    },
+                )
+                logging.info(f"Re-embedded {processed}/{pending} students ({rate:.1f} images/s)")
+                for error in errors:
+                    logging.warning(f"Re-embedding failed for {error}")
+
+        remaining = self.students_collection.count_documents(query)
+        elapsed = time.perf_counter() - start
+        rate = processed / elapsed if elapsed > 0 else 0.0
+        self.meta_collection.update_one(
+            {"_id": self.progress_id},
+            {"$set": {
+                "status": "stopped" if self.stop_requested else "done",
+                "remaining": remaining,
+                "images_per_second": round(rate, 2),
+                "updated_at": datetime.now(),
+            }},
+        )
+        logging.info(f"Re-embedding {self.embedding_version} finished: {processed} images in {elapsed:.1f}s "
+                     f"({rate:.1f} images/s), {remaining} students still without an embedding")
+        return self.progress()
+
+    def activate(self, force=False):
+        """Make this version the one recognition uses, in every worker."""
+        remaining = self.students_collection.count_documents(self.pending_query())
+        if remaining and not force:
+            raise RuntimeError(f"{remaining} students have no {self.embedding_version} embedding yet")
+        activate_embedding_version(self.meta_collection, self.embedding_version)
+        logging.info(f"Activated embedding version {self.embedding_version}")
+
+
+if __name__ == '__main__':
+    import database
+
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Re-embed registered students into a new embedding version")
+    parser.add_argument('--backbone', type=str, default=pipeline.EMBEDDING_BACKBONE)
+    parser.add_argument('--align', action='store_true', default=pipeline.FACE_ALIGN, help="landmark-aligned crops")
+    parser.add_argument('--batch-size', type=int, default=REEMBED_BATCH_SIZE)
+    parser.add_argument('--ml-batch-size', type=int, default=REEMBED_ML_BATCH_SIZE)
+    parser.add_argument('--images-dir', type=str, default=REGISTERED_DIR)
+    parser.add_argument('--legacy-channels', choices=['bgr', 'rgb'], default='bgr',
+                        help="channel order of images saved by /api/register before image_channels was "
+                             "recorded (/api/register/pdf ones are always rgb)")
+    parser.add_argument('--activate', action='store_true', help="switch recognition to the new version when done")
+    parser.add_argument('--force', action='store_true', help="activate even if some students failed")
+    args = parser.parse_args()
+
+    db = database.mongo_client()["attendance"]
+    job = ReembedJob(db, pipeline.embedding_version(args.backbone, args.align), images_dir=args.images_dir,
+                     batch_size=args.batch_size, legacy_channels=args.legacy_channels, ml_batch_size=args.ml_batch_size)
+    progress = job.run()
+    print(f"done={progress['done']} failed={progress['failed']} remaining={progress['remaining']} "
+          f"images/s={progress['images_per_second']}")
+    if args.activate:
+        job.activate(force=args.force)
@@ -0,0 +1,274 @@
+import argparse
+import collections
+import logging
+import uuid
+from datetime import datetime, timedelta
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+DAILY_COLLECTION = "attendance_daily"
+MONTHLY_COLLECTION = "attendance_monthly"
+BACKFILL_BATCH_SIZE = 1000
+# log_attendance counts a new check-in itself and then marks it, the backfill
+# leaves records this recent alone so it never counts one in between
+BACKFILL_MIN_AGE_SECONDS = 60
+
+
+def day_key(timestamp):
+    return timestamp.strftime("%Y-%m-%d")
+
+
+def month_key(timestamp):
+    return timestamp.strftime("%Y-%m")
+
+
+def rollup_updates(record):
+    """($daily_filter, daily_update), ($monthly_filter, monthly_update) for one check-in.
+
+    Rollups only ever grow by $inc/$addToSet, so applying the updates of a
+    batch of records in any order gives the same documents.
+    """
+    name, group, timestamp = record["name"], record["group"], record["timestamp"]
+    attended = bool(record.get("attended"))
+    counts = {"records": 1, "attended": int(attended), "not_attended": int(not attended)}
+    day, month = day_key(timestamp), month_key(timestamp)
+
+    daily = {
+        "$inc": counts,
+        "$setOnInsert": {"group": group, "day": datetime(timestamp.year, timestamp.month, timestamp.day)},
+        "$min": {"first_at": timestamp},
+        "$max": {"last_at": timestamp},
+    }
+    monthly = {
+        "$inc": counts,
+        "$setOnInsert": {"name": name, "group": group, "month": datetime(timestamp.year, timestamp.month, 1)},
+    }
+    if attended:
+        daily["$addToSet"] = {"present": name}
+        monthly["$addToSet"] = {"days_present": timestamp.day}
+    return ({"_id": f"{group}:{day}"}, daily), ({"_id": f"{group}:{name}:{month}"}, monthly)
+
+
+def merge_updates(updates):
+    """One update with the effect of several rollup_updates() on the same document."""
+    merged = {"$inc": {}, "$setOnInsert": {}, "$min": {}, "$max": {}, "$addToSet": {}}
+    for update in updates:
+        for field, value in update.get("$inc", {}).items():
+            merged["$inc"][field] = merged["$inc"].get(field, 0) + value
+        for field, value in update.get("$setOnInsert", {}).items():
+            merged["$setOnInsert"].setdefault(field, value)
+        for field, value in update.get("$min", {}).items():
+            merged["$min"][field] = min(merged["$min"].get(field, value), value)
+        for field, value in update.get("$max", {}).items():
+            merged["$max"][field] = max(merged["$max"].get(field, value), value)
+        for field, value in update.get("$addToSet", {}).items():
+            merged["$addToSet"].setdefault(field, {"$each": []})["$each"].append(value)
+    return {operator: fields for operator, fields in merged.items() if fields}
+
+
+class AttendanceRollups:
+    """Per-(group, day) and per-(student, month) attendance counters.
+
+    `log_attendance` updates both with every check-in, so reports read a
+    handful of small documents instead of scanning `attendance`. Raw records
+    counted here carry `rolled_up: True`; `backfill` adds the rest, including
+    check-ins whose rollup write failed.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.attendance_collection = db["attendance"]
+        self.students_collection = db["students"]
+        self.daily_collection = db[DAILY_COLLECTION]
+        self.monthly_collection = db[MONTHLY_COLLECTION]
+
+    def ensure_indexes(self):
+        self.daily_collection.create_index([("group", 1), ("day", 1)])
+        self.daily_collection.create_index([("day", 1)])
+        self.monthly_collection.create_index([("group", 1), ("month", 1)])
+        self.monthly_collection.create_index([("name", 1), ("group", 1), ("month", 1)])
+        self.attendance_collection.create_index([("rolled_up", 1)], sparse=True)
+
+    def record(self, record):
+        """Count one raw attendance record; the caller then marks it rolled_up=True."""
+        (daily_filter, daily), (monthly_filter, monthly) = rollup_updates(record)
+        self.daily_collection.update_one(daily_filter, daily, upsert=True)
+        self.monthly_collection.update_one(monthly_filter, monthly, upsert=True)
+
+    def backfill(self, batch_size=BACKFILL_BATCH_SIZE, min_age_seconds=BACKFILL_MIN_AGE_SECONDS):
+        """Add every record that is not counted yet, returns how many.
+
+        Safe to run while check-ins come in, and to re-run after an
+        interruption. Each batch is first claimed by setting rolled_up to a
+        batch token, and every rollup document it updates records that token
+        in `backfill_batches`, so it only takes the batch once. A batch left
+        claimed by an interrupted run is finished first, without counting
+        twice what already reached the rollups.
+        """
+        total = 0
+        for token in self.attendance_collection.distinct("rolled_up", {"rolled_up": {"$type": "string"}}):
+            logging.info(f"Finishing interrupted rollup batch {token}")
+            total += self.count_batch(token)
+
+        last_id = None
+        while True:
+            # Walk _id in order from the previous batch: the sparse rolled_up
+            # index cannot serve $exists: false, restarting from the first
+            # record every batch would rescan everything already counted
+            query = {"rolled_up": {"$exists": False}}
+            if last_id is not None:
+                query["_id"] = {"$gt": last_id}
+            ids = [record["_id"] for record in self.attendance_collection.find(query, {"_id": 1}).sort("_id", 1).limit(batch_size)]
+            if not ids:
+                break
+            last_id = ids[-1]
+
+            token = uuid.uuid4().hex
+            self.attendance_collection.update_many(
+                {
+                    "_id": {"$in": ids},
+                    "rolled_up": {"$exists": False},
+                    "timestamp": {"$lt": datetime.now() - timedelta(seconds=min_age_seconds)},
+                },
+                {"$set": {"rolled_up": token}},
+            )
+            total += self.count_batch(token)
+            logging.info(f"Rolled up {total} attendance records")
+        return total
+
+    def count_batch(self, token):
+        """Add the records claimed with `token` to the rollups and mark them rolled_up."""
+        records = list(self.attendance_collection.find({"rolled_up": token}, {"name": 1, "group": 1, "timestamp": 1, "attended": 1}))
+        daily_updates, monthly_updates = collections.defaultdict(list), collections.defaultdict(list)
+        for record in records:
+            (daily_filter, daily), (monthly_filter, monthly) = rollup_updates(record)
+            daily_updates[daily_filter["_id"]].append(daily)
+            monthly_updates[monthly_filter["_id"]].append(monthly)
+        self._apply_batch(self.daily_collection, daily_updates, token)
+        self._apply_batch(self.monthly_collection, monthly_updates, token)
+        self.attendance_collection.update_many({"rolled_up": token}, {"$set": {"rolled_up": True}})
+        return len(records)
+
+    @staticmethod
+    def _apply_batch(collection, updates_by_id, token):
+        # One update per rollup document, skipped if the document already has the batch
+        requests = []
+        for doc_id, updates in updates_by_id.items():
+            update = merge_updates(updates)
+            update.setdefault("$addToSet", {})["backfill_batches"] = token
+            requests.append(({"_id": doc_id, "backfill_batches": {"$ne": token}}, update))
+        if not requests:
+            return
+        try:
+            collection.bulk_write([UpdateOne(query, update, upsert=True) for query, update in requests], ordered=False)
+        except BulkWriteError as e:
+            # A duplicate _id means the document exists: either it already has
+            # this batch, or a live check-in created it meanwhile and it still
+            # needs the batch, which a plain update applies only in that case
+            errors = e.details["writeErrors"]
+            if any(error["code"] != 11000 for error in errors):
+                raise
+            for error in errors:
+                query, update = requests[error["index"]]
+                collection.update_one(query, update)
+
+    def rebuild(self, batch_size=BACKFILL_BATCH_SIZE):
+        """Recount everything from the raw records, e.g. after records were deleted.
+
+        Check-ins logged while this runs may be counted twice; run it when
+        nobody is checking in.
+        """
+        self.daily_collection.delete_many({})
+        self.monthly_collection.delete_many({})
+        self.attendance_collection.update_many({"rolled_up": {"$exists": True}}, {"$unset": {"rolled_up": ""}})
+        return self.backfill(batch_size, min_age_seconds=0)
+
+    def enrolled(self, groups):
+        return {group: self.students_collection.count_documents({"group": group}) for group in groups}
+
+    def daily_report(self, start, end, group=None):
+        """Attendance per group and day between start and end (dates, inclusive)."""
+        query = {"day": {"$gte": start, "$lte": end}}
+        if group is not None:
+            query["group"] = group
+        docs = list(self.daily_collection.find(query).sort([("group", 1), ("day", 1)]))
+        enrolled = self.enrolled({doc["group"] for doc in docs})
+
+        rows = []
+        for doc in docs:
+            present = len(doc.get("present", []))
+            students = enrolled[doc["group"]]
+            rows.append({
+                "group": doc["group"],
+                "day": day_key(doc["day"]),
+                "records": doc["records"],
+                "attended": doc["attended"],
+                "not_attended": doc["not_attended"],
+                "present": present,
+                "enrolled": students,
+                "rate": round(present / students, 4) if students else None,
+                "first_at": doc.get("first_at"),
+                "last_at": doc.get("last_at"),
+            })
+        return rows
+
+    def monthly_report(self, start, end, group=None, name=None):
+        """Attendance per student and month between start and end (first days of months).
+
+        A student's rate is the share of the group's class days (days with at
+        least one check-in in the group) they were present on.
+        """
+        query = {"month": {"$gte": start, "$lte": end}}
+        if group is not None:
+            query["group"] = group
+        if name is not None:
+            query["name"] = name
+        docs = list(self.monthly_collection.find(query).sort([("group", 1), ("name", 1), ("month", 1)]))
+
+        class_days = {}
+        for doc in docs:
+            key = (doc["group"], doc["month"])
+            if key not in class_days:
+                month_start = doc["month"]
+                month_end = datetime(month_start.year + month_start.month // 12, month_start.month % 12 + 1, 1)
+                class_days[key] = self.daily_collection.count_documents({
+                    "group": doc["group"],
+                    "day": {"$gte": month_start, "$lt": month_end},
+                    "attended": {"$gt": 0},
+                })
+
+        rows = []
+        for doc in docs:
+            days_present = len(doc.get("days_present", []))
+            days = class_days[(doc["group"], doc["month"])]
+            rows.append({
+                "name": doc["name"],
+                "group": doc["group"],
+                "month": month_key(doc["month"]),
+                "records": doc["records"],
+                "attended": doc["attended"],
+                "not_attended": doc["not_attended"],
+                "days_present": days_present,
+                "class_days": days,
+                "rate": round(days_present / days, 4) if days else None,
+            })
+        return rows
+
+
+if __name__ == '__main__':
+    import database
+
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Build the attendance rollups from existing attendance records")
+    parser.add_argument('--rebuild', action='store_true', help="drop the rollups and recount every record")
+    parser.add_argument('--batch-size', type=int, default=BACKFILL_BATCH_SIZE)
+    args = parser.parse_args()
+
+    rollups = AttendanceRollups(database.mongo_client()["attendance"])
+    rollups.ensure_indexes()
+    if args.rebuild:
+        total = rollups.rebuild(args.batch_size)
+    else:
+        total = rollups.backfill(args.batch_size)
+    print(f"Rolled up {total} attendance records")
@@ -0,0 +1,127 @@
+import logging
+import math
+import os
+
+import cv2
+import torch
+import torch.nn as nn
+
+# Thread budget for this process. Unset means "the container's CPU quota
+# divided between the workers".
+ML_NUM_THREADS = os.environ.get("ML_NUM_THREADS")
+ML_INTEROP_THREADS = int(os.environ.get("ML_INTEROP_THREADS", "1"))
+ML_CV_THREADS = os.environ.get("ML_CV_THREADS")
+
+# Opt-in FaceNetModel optimisations, compare them with bench_tuning.py first
+TORCH_CHANNELS_LAST = os.environ.get("TORCH_CHANNELS_LAST", "0") == "1"
+TORCH_AUTOCAST = os.environ.get("TORCH_AUTOCAST", "")  # "bf16" to enable
+TORCH_COMPILE = os.environ.get("TORCH_COMPILE", "0") == "1"
+
+AUTOCAST_DTYPES = {"bf16": torch.bfloat16, "bfloat16": torch.bfloat16}
+
+
+def cgroup_cpu_limit():
+    """CPUs allowed by the cgroup quota, or None when there is no quota."""
+    try:
+        # cgroup v2
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            return max(1, math.floor(int(quota) / int(period)))
+        return None
+    except (OSError, ValueError):
+        pass
+    try:
+        # cgroup v1
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+            quota = int(f.read())
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+            period = int(f.read())
+        if quota > 0:
+            return max(1, math.floor(quota / period))
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def available_cpus():
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    limit = cgroup_cpu_limit()
+    return min(cpus, limit) if limit else cpus
+
+
+def thread_budget():
+    if ML_NUM_THREADS:
+        return max(1, int(ML_NUM_THREADS))
+    workers = int(os.environ.get("WEB_CONCURRENCY", "1"))
+    return max(1, available_cpus() // max(1, workers))
+
+
+def apply_thread_budget():
+    """Give torch and OpenCV the same per-process thread budget.
+
+    The stages of a request run one after another, so torch and cv2.dnn can
+    each use the whole budget; what oversubscribes small containers is each
+    library (and each worker) sizing its pool from the host's core count.
+    dlib's HOG detector and shape predictor are single threaded.
+    """
+    threads = thread_budget()
+    cv_threads = int(ML_CV_THREADS) if ML_CV_THREADS else threads
+
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(ML_INTEROP_THREADS)
+    except RuntimeError:
+        # Can only be set before the first inter-op parallel work, e.g. in a forked worker
+        pass
+    cv2.setNumThreads(cv_threads)
+    logging.info(f"Thread budget: torch={threads} (interop={torch.get_num_interop_threads()}), opencv={cv_threads}")
+    return threads
+
+
+class TunedModel(nn.Module):
+    """Wraps FaceNetModel with the optional CPU inference settings.
+
+    Inputs are converted to channels_last and outputs back to float32, so
+    callers keep passing normal NCHW float batches.
+    """
+
+    def __init__(self, model, channels_last=False, autocast_dtype=None, compile=False):
+        super(TunedModel, self).__init__()
+        self.model = model
+        self.channels_last = channels_last
+        self.autocast_dtype = autocast_dtype
+        if channels_last:
+            self.model = self.model.to(memory_format=torch.channels_last)
+        self.forward_fn = torch.compile(self.model) if compile else self.model
+
+    def forward(self, x):
+        if self.channels_last:
+            x = x.contiguous(memory_format=torch.channels_last)
+        if self.autocast_dtype is not None:
+            with torch.autocast(device_type=x.device.type, dtype=self.autocast_dtype):
+                return self.forward_fn(x).float()
+        return self.forward_fn(x)
+
+
+def optimize_model(model, channels_last=None, autocast=None, compile=None):
+    """Apply the configured optimisations, returns the model unchanged if none are on."""
+    channels_last = TORCH_CHANNELS_LAST if channels_last is None else channels_last
+    autocast = TORCH_AUTOCAST if autocast is None else autocast
+    compile = TORCH_COMPILE if compile is None else compile
+
+    autocast_dtype = None
+    if autocast:
+        if autocast not in AUTOCAST_DTYPES:
+            raise ValueError(f"Unsupported TORCH_AUTOCAST value: {autocast}")
+        autocast_dtype = AUTOCAST_DTYPES[autocast]
+
+    if not (channels_last or autocast_dtype or compile):
+        return model
+    logging.info(f"Model tuning: channels_last={channels_last}, autocast={autocast or 'off'}, compile={compile}")
+    tuned = TunedModel(model, channels_last=channels_last, autocast_dtype=autocast_dtype, compile=compile)
+    tuned.eval()
+    return tuned
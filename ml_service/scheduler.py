@@ -0,0 +1,230 @@
+import asyncio
+import collections
+import concurrent.futures
+import contextvars
+import heapq
+import itertools
+import logging
+import math
+import os
+import threading
+import time
+
+import numpy as np
+
+import profiling
+
+# Lower runs first: live check-ins, then single registrations, then PDF/bulk work
+PRIORITY_RECOGNIZE = 0
+PRIORITY_REGISTER = 1
+PRIORITY_BULK = 2
+PRIORITY_NAMES = {PRIORITY_RECOGNIZE: "recognize", PRIORITY_REGISTER: "register", PRIORITY_BULK: "bulk"}
+
+# Threads running ML work per process. Torch already uses several threads per
+# call and YOLO is serialised, so more workers mostly add contention.
+ML_WORKERS = int(os.environ.get("ML_WORKERS", "1"))
+# Jobs allowed to wait; past this new work gets a 503 instead of a longer queue
+ML_QUEUE_SIZE = int(os.environ.get("ML_QUEUE_SIZE", "32"))
+# Bulk work is only admitted while fewer jobs than this are waiting, so PDF
+# uploads can never fill the queue in front of check-ins
+ML_BULK_QUEUE_SIZE = int(os.environ.get("ML_BULK_QUEUE_SIZE", "8"))
+# Recent jobs per priority kept for the wait/service percentiles
+ML_QUEUE_STATS_WINDOW = 500
+
+
+class Overloaded(Exception):
+    """The queue has no room for this priority, retry after `retry_after` seconds."""
+
+    def __init__(self, priority, retry_after):
+        super().__init__(f"Inference queue full for {PRIORITY_NAMES[priority]} work")
+        self.priority = priority
+        self.retry_after = retry_after
+
+
+class _Job:
+    __slots__ = ("priority", "seq", "fn", "args", "context", "future", "enqueued_at")
+
+    def __init__(self, priority, seq, fn, args):
+        self.priority = priority
+        self.seq = seq
+        self.fn = fn
+        self.args = args
+        # Carries the request's stage timings and profiler into the worker thread
+        self.context = contextvars.copy_context()
+        self.future = concurrent.futures.Future()
+        self.enqueued_at = time.perf_counter()
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class _ClassStats:
+    def __init__(self):
+        self.admitted = 0
+        self.rejected = 0
+        self.cancelled = 0
+        self.completed = 0
+        self.failed = 0
+        self.wait_ms = collections.deque(maxlen=ML_QUEUE_STATS_WINDOW)
+        self.service_ms = collections.deque(maxlen=ML_QUEUE_STATS_WINDOW)
+
+    def mean_service_seconds(self):
+        if not self.service_ms:
+            return 1.0
+        return sum(self.service_ms) / len(self.service_ms) / 1000
+
+    def report(self):
+        report = {
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "cancelled": self.cancelled,
+            "completed": self.completed,
+            "failed": self.failed,
+        }
+        for name, samples in (("wait_ms", self.wait_ms), ("service_ms", self.service_ms)):
+            if samples:
+                p50, p95, p99 = np.percentile(list(samples), [50, 95, 99])
+                report[name] = {"p50": round(float(p50), 2), "p95": round(float(p95), 2), "p99": round(float(p99), 2)}
+            else:
+                report[name] = None
+        return report
+
+
+class InferenceScheduler:
+    """Bounded priority queue in front of the detection and embedding stages.
+
+    Endpoints hand their ML work to `run` instead of doing it on the event
+    loop. A fixed pool of threads takes jobs in priority order, so a burst of
+    PDF registrations waits behind check-ins instead of in front of them, and
+    a full queue is reported straight away as `Overloaded` (503).
+
+    Threads start on first use, so each forked worker gets its own.
+    """
+
+    def __init__(self, workers=ML_WORKERS, max_queue=ML_QUEUE_SIZE, max_bulk_queue=ML_BULK_QUEUE_SIZE):
+        self.workers = max(1, workers)
+        self.limits = {
+            PRIORITY_RECOGNIZE: max_queue,
+            PRIORITY_REGISTER: max_queue,
+            PRIORITY_BULK: min(max_bulk_queue, max_queue),
+        }
+        self._pid = None
+        self._seq = itertools.count()
+        self._heap = []
+        self._running = 0
+        self._cond = threading.Condition()
+        self._stats = {priority: _ClassStats() for priority in PRIORITY_NAMES}
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._cond:
+            if self._pid == os.getpid():
+                return
+            for i in range(self.workers):
+                threading.Thread(target=self._worker, name=f"ml-worker-{i}", daemon=True).start()
+            self._pid = os.getpid()
+            logging.info(f"Started {self.workers} ML worker threads, queue limits {self.limits}")
+
+    def retry_after(self, priority):
+        """Seconds until the queue ahead of `priority` should have drained."""
+        ahead = sum(1 for job in self._heap if job.priority <= priority) + self._running
+        seconds = ahead * self._stats[priority].mean_service_seconds() / self.workers
+        return min(60, max(1, math.ceil(seconds)))
+
+    def submit(self, priority, fn, *args):
+        """Queue fn(*args), returns a concurrent.futures.Future or raises Overloaded."""
+        self._ensure_started()
+        with self._cond:
+            stats = self._stats[priority]
+            if len(self._heap) >= self.limits[priority]:
+                stats.rejected += 1
+                raise Overloaded(priority, self.retry_after(priority))
+            job = _Job(priority, next(self._seq), fn, args)
+            heapq.heappush(self._heap, job)
+            stats.admitted += 1
+            self._cond.notify()
+        return job.future
+
+    async def run(self, priority, fn, *args, wait_for_room=False):
+        """Run fn(*args) on an ML worker and return its result.
+
+        With `wait_for_room`, a full queue is waited out instead of raising,
+        for background work that has no client to send a 503 to.
+        """
+        while True:
+            try:
+                future = self.submit(priority, fn, *args)
+                break
+            except Overloaded as e:
+                if not wait_for_room:
+                    raise
+                await asyncio.sleep(e.retry_after)
+        # Cancelling the request (client gone) cancels the job if it has not started
+        return await asyncio.wrap_future(future)
+
+    def call(self, priority, fn, *args, wait_for_room=False):
+        """Blocking `run`, for threads outside the event loop."""
+        while True:
+            try:
+                future = self.submit(priority, fn, *args)
+                break
+            except Overloaded as e:
+                if not wait_for_room:
+                    raise
+                time.sleep(e.retry_after)
+        return future.result()
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while not self._heap:
+                    self._cond.wait()
+                job = heapq.heappop(self._heap)
+                stats = self._stats[job.priority]
+                if not job.future.set_running_or_notify_cancel():
+                    stats.cancelled += 1
+                    continue
+                self._running += 1
+
+            wait_ms = (time.perf_counter() - job.enqueued_at) * 1000
+            start = time.perf_counter()
+            try:
+                result = job.context.run(self._execute, job, wait_ms)
+            except BaseException as e:
+                failed = True
+                job.future.set_exception(e)
+            else:
+                failed = False
+                job.future.set_result(result)
+            service_ms = (time.perf_counter() - start) * 1000
+
+            with self._cond:
+                self._running -= 1
+                stats.wait_ms.append(wait_ms)
+                stats.service_ms.append(service_ms)
+                if failed:
+                    stats.failed += 1
+                else:
+                    stats.completed += 1
+
+    @staticmethod
+    def _execute(job, wait_ms):
+        stages = profiling.current_stages()
+        if stages is not None:
+            stages.append({"stage": "queue_wait", "ms": round(wait_ms, 2)})
+        with profiling.profile_thread(), profiling.stage("ml_service"):
+            return job.fn(*job.args)
+
+    def stats(self):
+        with self._cond:
+            return {
+                "workers": self.workers,
+                "running": self._running,
+                "queued": {
+                    PRIORITY_NAMES[priority]: sum(1 for job in self._heap if job.priority == priority)
+                    for priority in PRIORITY_NAMES
+                },
+                "limits": {PRIORITY_NAMES[priority]: limit for priority, limit in self.limits.items()},
+                "classes": {PRIORITY_NAMES[priority]: stats.report() for priority, stats in self._stats.items()},
+            }
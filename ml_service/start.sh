@@ -2,6 +2,12 @@
 
 # Default port ke 8080 jika PORT tidak di-set
 export PORT="${PORT:-8080}"
+export WEB_CONCURRENCY="${WEB_CONCURRENCY:-1}"
 
 # Start the application
-exec uvicorn main:app --host 0.0.0.0 --port "$PORT"
\ No newline at end of file
+if [ "$WEB_CONCURRENCY" -gt 1 ]; then
+    # Several workers sharing models loaded once in the master, see gunicorn.conf.py
+    exec gunicorn -c gunicorn.conf.py main:app
+fi
+
+exec uvicorn main:app --host 0.0.0.0 --port "$PORT"
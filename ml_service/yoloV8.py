@@ -4,7 +4,7 @@ import math
 import argparse
 
 class YOLOv8_face:
-    def __init__(self, path, conf_thres=0.2, iou_thres=0.5):
+    def __init__(self, path, conf_thres=0.2, iou_thres=0.5, input_sizes=(640,)):
         self.conf_threshold = conf_thres
         self.iou_threshold = iou_thres
         self.class_names = ['face']
@@ -17,8 +17,18 @@ class YOLOv8_face:
 
         self.project = np.arange(self.reg_max)
         self.strides = (8, 16, 32)
-        self.feats_hw = [(math.ceil(self.input_height / self.strides[i]), math.ceil(self.input_width / self.strides[i])) for i in range(len(self.strides))]
-        self.anchors = self.make_anchors(self.feats_hw)
+        # The network is fully convolutional, square inputs that are a multiple
+        # of the largest stride work; anchors are precomputed for each size
+        self.input_sizes = tuple(sorted(set(input_sizes) | {self.input_height}))
+        for size in self.input_sizes:
+            if size % self.strides[-1] != 0:
+                raise ValueError(f"Input size {size} must be a multiple of {self.strides[-1]}")
+        self.anchors_by_size = {size: self.make_anchors(self.feats_hw_for(size)) for size in self.input_sizes}
+        self.feats_hw = self.feats_hw_for(self.input_height)
+        self.anchors = self.anchors_by_size[self.input_height]
+
+    def feats_hw_for(self, size):
+        return [(math.ceil(size / self.strides[i]), math.ceil(size / self.strides[i])) for i in range(len(self.strides))]
 
     def make_anchors(self, feats_hw, grid_cell_offset=0.5):
         """Generate anchors from features."""
@@ -39,28 +49,35 @@ class YOLOv8_face:
         s = x_exp / x_sum
         return s
     
-    def resize_image(self, srcimg, keep_ratio=True):
-        top, left, newh, neww = 0, 0, self.input_width, self.input_height
+    def resize_image(self, srcimg, keep_ratio=True, input_size=None):
+        input_height = input_width = input_size or self.input_height
+        top, left, newh, neww = 0, 0, input_width, input_height
         if keep_ratio and srcimg.shape[0] != srcimg.shape[1]:
             hw_scale = srcimg.shape[0] / srcimg.shape[1]
             if hw_scale > 1:
-                newh, neww = self.input_height, int(self.input_width / hw_scale)
+                newh, neww = input_height, int(input_width / hw_scale)
                 img = cv2.resize(srcimg, (neww, newh), interpolation=cv2.INTER_AREA)
-                left = int((self.input_width - neww) * 0.5)
-                img = cv2.copyMakeBorder(img, 0, 0, left, self.input_width - neww - left, cv2.BORDER_CONSTANT,
+                left = int((input_width - neww) * 0.5)
+                img = cv2.copyMakeBorder(img, 0, 0, left, input_width - neww - left, cv2.BORDER_CONSTANT,
                                          value=(0, 0, 0))  # add border
             else:
-                newh, neww = int(self.input_height * hw_scale), self.input_width
+                newh, neww = int(input_height * hw_scale), input_width
                 img = cv2.resize(srcimg, (neww, newh), interpolation=cv2.INTER_AREA)
-                top = int((self.input_height - newh) * 0.5)
-                img = cv2.copyMakeBorder(img, top, self.input_height - newh - top, 0, 0, cv2.BORDER_CONSTANT,
+                top = int((input_height - newh) * 0.5)
+                img = cv2.copyMakeBorder(img, top, input_height - newh - top, 0, 0, cv2.BORDER_CONSTANT,
                                          value=(0, 0, 0))
         else:
-            img = cv2.resize(srcimg, (self.input_width, self.input_height), interpolation=cv2.INTER_AREA)
+            img = cv2.resize(srcimg, (input_width, input_height), interpolation=cv2.INTER_AREA)
         return img, newh, neww, top, left
 
-    def detect(self, srcimg):
-        input_img, newh, neww, padh, padw = self.resize_image(cv2.cvtColor(srcimg, cv2.COLOR_BGR2RGB))
+    def detect(self, srcimg, input_size=None, rgb=False):
+        input_size = input_size or self.input_height
+        if input_size not in self.anchors_by_size:
+            raise ValueError(f"Input size {input_size} not configured, use one of {self.input_sizes}")
+        # The network takes RGB, callers that already hold RGB pixels skip the conversion
+        if not rgb:
+            srcimg = cv2.cvtColor(srcimg, cv2.COLOR_BGR2RGB)
+        input_img, newh, neww, padh, padw = self.resize_image(srcimg, input_size=input_size)
         scale_h, scale_w = srcimg.shape[0]/newh, srcimg.shape[1]/neww
         input_img = input_img.astype(np.float32) / 255.0
 
@@ -72,13 +89,15 @@ class YOLOv8_face:
         # if float(cv2.__version__[:3])>=4.7:
         #     outputs = [outputs[2], outputs[0], outputs[1]] ###opencv4.7需要这一步，opencv4.5不需要
         # Perform inference on the image
-        det_bboxes, det_conf, det_classid, landmarks = self.post_process(outputs, scale_h, scale_w, padh, padw)
+        det_bboxes, det_conf, det_classid, landmarks = self.post_process(outputs, scale_h, scale_w, padh, padw, input_size)
         return det_bboxes, det_conf, det_classid, landmarks
 
-    def post_process(self, preds, scale_h, scale_w, padh, padw):
+    def post_process(self, preds, scale_h, scale_w, padh, padw, input_size=None):
+        input_size = input_size or self.input_height
+        anchors = self.anchors_by_size[input_size]
         bboxes, scores, landmarks = [], [], []
         for i, pred in enumerate(preds):
-            stride = int(self.input_height/pred.shape[2])
+            stride = int(input_size/pred.shape[2])
             pred = pred.transpose((0, 2, 3, 1))
             
             box = pred[..., :self.reg_max * 4]
@@ -90,9 +109,9 @@ class YOLOv8_face:
             bbox_pred = self.softmax(tmp, axis=-1)
             bbox_pred = np.dot(bbox_pred, self.project).reshape((-1,4))
 
-            bbox = self.distance2bbox(self.anchors[stride], bbox_pred, max_shape=(self.input_height, self.input_width)) * stride
-            kpts[:, 0::3] = (kpts[:, 0::3] * 2.0 + (self.anchors[stride][:, 0].reshape((-1,1)) - 0.5)) * stride
-            kpts[:, 1::3] = (kpts[:, 1::3] * 2.0 + (self.anchors[stride][:, 1].reshape((-1,1)) - 0.5)) * stride
+            bbox = self.distance2bbox(anchors[stride], bbox_pred, max_shape=(input_size, input_size)) * stride
+            kpts[:, 0::3] = (kpts[:, 0::3] * 2.0 + (anchors[stride][:, 0].reshape((-1,1)) - 0.5)) * stride
+            kpts[:, 1::3] = (kpts[:, 1::3] * 2.0 + (anchors[stride][:, 1].reshape((-1,1)) - 0.5)) * stride
             kpts[:, 2::3] = 1 / (1+np.exp(-kpts[:, 2::3]))
 
             bbox -= np.array([[padw, padh, padw, padh]])  ###合理使用广播法则
@@ -162,14 +181,15 @@ if __name__ == '__main__':
                         help="onnx filepath")
     parser.add_argument('--confThreshold', default=0.45, type=float, help='class confidence')
     parser.add_argument('--nmsThreshold', default=0.5, type=float, help='nms iou thresh')
+    parser.add_argument('--inputSize', default=640, type=int, help='square network input size, multiple of 32')
     args = parser.parse_args()
 
     # Initialize YOLOv8_face object detector
-    YOLOv8_face_detector = YOLOv8_face(args.modelpath, conf_thres=args.confThreshold, iou_thres=args.nmsThreshold)
+    YOLOv8_face_detector = YOLOv8_face(args.modelpath, conf_thres=args.confThreshold, iou_thres=args.nmsThreshold, input_sizes=(args.inputSize,))
     srcimg = cv2.imread(args.imgpath)
 
     # Detect Objects
-    boxes, scores, classids, kpts = YOLOv8_face_detector.detect(srcimg)
+    boxes, scores, classids, kpts = YOLOv8_face_detector.detect(srcimg, input_size=args.inputSize)
 
     # Draw detections
     dstimg = YOLOv8_face_detector.draw_detections(srcimg, boxes, scores, kpts)